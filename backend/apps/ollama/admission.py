@@ -0,0 +1,293 @@
+from collections import deque
+from typing import Deque, Dict, List, Optional
+import asyncio
+import math
+import time
+
+
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+PRIORITIES = [INTERACTIVE, BACKGROUND]
+
+
+class QueueFullError(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__("Queue full")
+        self.retry_after = retry_after
+
+
+class Ticket:
+    def __init__(
+        self,
+        key: str,
+        user_id: str,
+        priority: str = INTERACTIVE,
+        preemptible: bool = False,
+    ):
+        self.key = key
+        self.user_id = user_id
+        self.priority = priority
+        # Only requests that can be restarted without the client noticing
+        self.preemptible = preemptible
+        self.enqueued_at = time.time()
+        self.granted_at: Optional[float] = None
+        self.released = False
+        self.preemptions = 0
+        self.event = asyncio.Event()
+        self.preempted = asyncio.Event()
+
+    @property
+    def granted(self) -> bool:
+        return self.event.is_set()
+
+    def grant(self):
+        self.granted_at = time.time()
+        self.preempted.clear()
+        self.event.set()
+
+    def preempt(self):
+        self.preemptions += 1
+        self.event.clear()
+        self.preempted.set()
+
+    async def wait(self, timeout: Optional[float] = None) -> bool:
+        try:
+            await asyncio.wait_for(self.event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self.granted
+
+
+class RoundRobinQueue:
+    """Waiting tickets kept per user and handed out round-robin across users,
+    so a user with many queued requests only gets every n-th turn."""
+
+    def __init__(self):
+        self.queues: Dict[str, Deque[Ticket]] = {}
+        # Users with waiting tickets, in the order they are served next
+        self.order: Deque[str] = deque()
+
+    def __len__(self) -> int:
+        return sum(len(queue) for queue in self.queues.values())
+
+    def user_waiting(self, user_id: str) -> int:
+        return len(self.queues.get(user_id, ()))
+
+    def append(self, ticket: Ticket, front: bool = False):
+        if ticket.user_id not in self.queues:
+            self.queues[ticket.user_id] = deque()
+            if front:
+                self.order.appendleft(ticket.user_id)
+            else:
+                self.order.append(ticket.user_id)
+
+        if front:
+            self.queues[ticket.user_id].appendleft(ticket)
+        else:
+            self.queues[ticket.user_id].append(ticket)
+
+    def pop(self) -> Ticket:
+        user_id = self.order.popleft()
+        queue = self.queues[user_id]
+        ticket = queue.popleft()
+        if queue:
+            self.order.append(user_id)
+        else:
+            del self.queues[user_id]
+        return ticket
+
+    def remove(self, ticket: Ticket):
+        queue = self.queues.get(ticket.user_id)
+        if queue is None or ticket not in queue:
+            return
+
+        queue.remove(ticket)
+        if not queue:
+            del self.queues[ticket.user_id]
+            self.order.remove(ticket.user_id)
+
+    def position(self, ticket: Ticket) -> int:
+        queue = self.queues.get(ticket.user_id)
+        if queue is None or ticket not in queue:
+            return 0
+
+        # Every user ahead in the rotation gets idx + 1 turns before this
+        # ticket, everyone behind it gets idx
+        idx = queue.index(ticket)
+        ahead = idx
+        before = True
+        for user_id in self.order:
+            if user_id == ticket.user_id:
+                before = False
+                continue
+            turns = idx + 1 if before else idx
+            ahead += min(len(self.queues[user_id]), turns)
+        return ahead + 1
+
+    def to_dict(self) -> dict:
+        return {user_id: len(queue) for user_id, queue in self.queues.items()}
+
+
+class FairQueue:
+    """Concurrency slots for one backend.
+
+    Interactive tickets are always served first. Background tickets only get
+    a slot when no interactive request is waiting, and a preemptible
+    background ticket gives its slot up when an interactive one arrives.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active: List[Ticket] = []
+        self.waiting_queues = {priority: RoundRobinQueue() for priority in PRIORITIES}
+        self.preemptions = 0
+        # Moving average of how long a slot is held, used for Retry-After
+        self.avg_duration = 10.0
+
+    @property
+    def waiting(self) -> int:
+        return sum(len(queue) for queue in self.waiting_queues.values())
+
+    def user_waiting(self, user_id: str) -> int:
+        return sum(
+            queue.user_waiting(user_id) for queue in self.waiting_queues.values()
+        )
+
+    def enqueue(self, ticket: Ticket):
+        self.waiting_queues[ticket.priority].append(ticket)
+        self.dispatch()
+
+        if ticket.priority == INTERACTIVE and not ticket.granted:
+            self.preempt()
+
+    def preempt(self):
+        # Take the slot of the most recently started preemptible background ticket
+        for ticket in reversed(self.active):
+            if ticket.priority == BACKGROUND and ticket.preemptible:
+                self.active.remove(ticket)
+                ticket.preempt()
+                self.preemptions += 1
+                # Restarted ahead of other background work once capacity frees up
+                self.waiting_queues[BACKGROUND].append(ticket, front=True)
+                self.dispatch()
+                return
+
+    def dispatch(self):
+        while len(self.active) < self.limit:
+            for priority in PRIORITIES:
+                if len(self.waiting_queues[priority]):
+                    ticket = self.waiting_queues[priority].pop()
+                    self.active.append(ticket)
+                    ticket.grant()
+                    break
+            else:
+                return
+
+    def release(self, ticket: Ticket):
+        if ticket.released:
+            return
+        ticket.released = True
+
+        if ticket in self.active:
+            self.active.remove(ticket)
+            duration = time.time() - ticket.granted_at
+            self.avg_duration = 0.9 * self.avg_duration + 0.1 * duration
+        else:
+            self.waiting_queues[ticket.priority].remove(ticket)
+        self.dispatch()
+
+    def position(self, ticket: Ticket) -> int:
+        """1-based position of a waiting ticket, 0 once it has a slot."""
+        if ticket.granted:
+            return 0
+
+        position = self.waiting_queues[ticket.priority].position(ticket)
+        if position and ticket.priority == BACKGROUND:
+            position += len(self.waiting_queues[INTERACTIVE])
+        return position
+
+    def estimate_wait(self, position: int) -> int:
+        return max(1, math.ceil(position * self.avg_duration / max(self.limit, 1)))
+
+    def to_dict(self) -> dict:
+        return {
+            "limit": self.limit,
+            "active": {
+                priority: len([t for t in self.active if t.priority == priority])
+                for priority in PRIORITIES
+            },
+            "waiting": {
+                priority: queue.to_dict()
+                for priority, queue in self.waiting_queues.items()
+            },
+            "preemptions": self.preemptions,
+            "avg_duration": round(self.avg_duration, 3),
+        }
+
+
+class AdmissionController:
+    """Admission control for generation requests, one fair queue per backend."""
+
+    def __init__(
+        self,
+        max_concurrent: int = 4,
+        max_queue_size: int = 64,
+        max_queue_per_user: int = 8,
+    ):
+        self.max_concurrent = max_concurrent
+        self.max_queue_size = max_queue_size
+        self.max_queue_per_user = max_queue_per_user
+        self.queues: Dict[str, FairQueue] = {}
+
+    def get_queue(self, key: str) -> FairQueue:
+        if key not in self.queues:
+            self.queues[key] = FairQueue(self.max_concurrent)
+        return self.queues[key]
+
+    def acquire(
+        self,
+        key: str,
+        user_id: str,
+        priority: str = INTERACTIVE,
+        preemptible: bool = False,
+    ) -> Ticket:
+        """Take a slot on ``key`` or join its queue.
+
+        The returned ticket may not be granted yet, await ``ticket.wait()``.
+        Raises ``QueueFullError`` when the queue (or the user's share of it)
+        is full.
+        """
+        queue = self.get_queue(key)
+        if len(queue.active) >= queue.limit and (
+            queue.waiting >= self.max_queue_size
+            or queue.user_waiting(user_id) >= self.max_queue_per_user
+        ):
+            raise QueueFullError(queue.estimate_wait(queue.waiting + 1))
+
+        ticket = Ticket(key, user_id, priority, preemptible)
+        queue.enqueue(ticket)
+        return ticket
+
+    def release(self, ticket: Ticket):
+        self.get_queue(ticket.key).release(ticket)
+
+    def position(self, ticket: Ticket) -> int:
+        return self.get_queue(ticket.key).position(ticket)
+
+    def set_limits(
+        self, max_concurrent: int, max_queue_size: int, max_queue_per_user: int
+    ):
+        self.max_concurrent = max_concurrent
+        self.max_queue_size = max_queue_size
+        self.max_queue_per_user = max_queue_per_user
+        for queue in self.queues.values():
+            queue.limit = max_concurrent
+            queue.dispatch()
+
+    def to_dict(self) -> dict:
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_queue_size": self.max_queue_size,
+            "max_queue_per_user": self.max_queue_per_user,
+            "backends": {key: queue.to_dict() for key, queue in self.queues.items()},
+        }
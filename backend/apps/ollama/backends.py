@@ -0,0 +1,130 @@
+from typing import Callable, List, Optional
+import asyncio
+import time
+
+import aiohttp
+
+
+class OllamaBackend:
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+        self.healthy = True
+        self.outstanding = 0
+        self.models: set = set()
+        self.loaded_models: set = set()
+        self.last_check: Optional[float] = None
+        self.error: Optional[str] = None
+
+    def to_dict(self) -> dict:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "models": sorted(self.models),
+            "loaded_models": sorted(self.loaded_models),
+            "last_check": self.last_check,
+            "error": self.error,
+        }
+
+
+def normalize_model_name(model: str) -> str:
+    # Anything but a string is left for Ollama to reject
+    if not isinstance(model, str):
+        return model
+    return model if ":" in model else f"{model}:latest"
+
+
+class BackendPool:
+    """A set of Ollama servers the proxy can route to.
+
+    A background task polls /api/tags and /api/ps on every backend so
+    routing can prefer a healthy backend that already has the model loaded.
+    """
+
+    def __init__(self, urls: List[str], health_check_interval: float = 10):
+        self.backends: List[OllamaBackend] = []
+        self.health_check_interval = health_check_interval
+        self.task: Optional[asyncio.Task] = None
+        self.set_urls(urls)
+
+    @property
+    def urls(self) -> List[str]:
+        return [backend.url for backend in self.backends]
+
+    def set_urls(self, urls: List[str]):
+        # Keep the state of backends that stay in the pool
+        existing = {backend.url: backend for backend in self.backends}
+        self.backends = [
+            existing[url.rstrip("/")]
+            if url.rstrip("/") in existing
+            else OllamaBackend(url)
+            for url in urls
+            if url
+        ]
+
+    def get(self, idx: int) -> OllamaBackend:
+        return self.backends[idx]
+
+    def select(self, model: Optional[str] = None) -> OllamaBackend:
+        candidates = [backend for backend in self.backends if backend.healthy]
+        if not candidates:
+            # Nothing passed a health check yet, let the request surface the error
+            candidates = self.backends
+
+        if isinstance(model, str) and model:
+            model = normalize_model_name(model)
+
+            # Prefer backends that have the model loaded, then ones that have it pulled
+            loaded = [b for b in candidates if model in b.loaded_models]
+            available = [b for b in candidates if model in b.models]
+            candidates = loaded or available or candidates
+
+        return min(candidates, key=lambda backend: backend.outstanding)
+
+    async def check_backend(self, session: aiohttp.ClientSession, backend):
+        timeout = aiohttp.ClientTimeout(total=5)
+        try:
+            async with session.get(f"{backend.url}/api/tags", timeout=timeout) as r:
+                r.raise_for_status()
+                data = await r.json()
+                backend.models = set(model["name"] for model in data.get("models", []))
+
+            # /api/ps is missing on older Ollama versions
+            async with session.get(f"{backend.url}/api/ps", timeout=timeout) as r:
+                if r.status == 200:
+                    data = await r.json()
+                    backend.loaded_models = set(
+                        model["name"] for model in data.get("models", [])
+                    )
+
+            backend.healthy = True
+            backend.error = None
+        except Exception as e:
+            backend.healthy = False
+            backend.error = str(e) or e.__class__.__name__
+        finally:
+            backend.last_check = time.time()
+
+    async def check(self, session: aiohttp.ClientSession):
+        await asyncio.gather(
+            *[self.check_backend(session, backend) for backend in self.backends]
+        )
+
+    def start(self, get_session: Callable):
+        if self.task is not None and not self.task.done():
+            return
+
+        async def run():
+            while True:
+                try:
+                    await self.check(await get_session())
+                except Exception as e:
+                    print(e)
+                await asyncio.sleep(self.health_check_interval)
+
+        self.task = asyncio.create_task(run())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
@@ -0,0 +1,172 @@
+from typing import Callable, Dict, List, Optional, Tuple
+import asyncio
+import json
+import time
+
+
+class EmbeddingError(Exception):
+    def __init__(self, status: int, detail: str):
+        super().__init__(detail)
+        self.status = status
+        self.detail = detail
+
+
+class EmbeddingBatch:
+    def __init__(self, url: str, model: str, extra: dict):
+        self.url = url
+        self.model = model
+        self.extra = extra
+        self.prompts: List[str] = []
+        self.futures: List[asyncio.Future] = []
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+class EmbeddingBatcher:
+    """Collects concurrent /api/embeddings requests for the same model.
+
+    After ``window`` seconds (or once ``max_batch_size`` prompts are waiting)
+    each prompt gets its own /api/embeddings request, all sent at once over
+    the pooled session. With ``mode="embed"`` they are sent as one /api/embed
+    request instead (falling back to the former on backends without it),
+    which returns unit-length vectors.
+    """
+
+    def __init__(
+        self,
+        get_session: Callable,
+        window: float = 0.01,
+        max_batch_size: int = 32,
+        mode: str = "pipeline",
+    ):
+        self.get_session = get_session
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self.mode = mode
+        self.pending: Dict[Tuple, EmbeddingBatch] = {}
+        # Backends that answered 404 on /api/embed
+        self.unsupported = set()
+
+        self.batches = 0
+        self.prompts = 0
+        self.batch_sizes: Dict[int, int] = {}
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0
+
+    async def embed(self, url: str, model: str, prompt: str, extra: dict) -> list:
+        key = (url, model, json.dumps(extra, sort_keys=True))
+        batch = self.pending.get(key)
+        if batch is None:
+            batch = EmbeddingBatch(url, model, extra)
+            batch.timer = asyncio.get_running_loop().call_later(
+                self.window, self.flush, key
+            )
+            self.pending[key] = batch
+
+        future = asyncio.get_running_loop().create_future()
+        batch.prompts.append(prompt)
+        batch.futures.append(future)
+
+        if len(batch.prompts) >= self.max_batch_size:
+            self.flush(key)
+
+        return await future
+
+    def flush(self, key: Tuple):
+        batch = self.pending.pop(key, None)
+        if batch is None:
+            return
+
+        batch.timer.cancel()
+        asyncio.ensure_future(self.send(batch))
+
+    async def send(self, batch: EmbeddingBatch):
+        start_time = time.time()
+        try:
+            if self.mode == "embed" and batch.url not in self.unsupported:
+                embeddings = await self.send_embed(batch)
+                if embeddings is None:
+                    self.unsupported.add(batch.url)
+                    embeddings = await self.send_pipelined(batch)
+            else:
+                embeddings = await self.send_pipelined(batch)
+
+            if len(embeddings) != len(batch.futures):
+                raise EmbeddingError(500, "Ollama: Unexpected embedding response")
+
+            for future, embedding in zip(batch.futures, embeddings):
+                if not future.done():
+                    if isinstance(embedding, Exception):
+                        future.set_exception(embedding)
+                    else:
+                        future.set_result(embedding)
+        except Exception as e:
+            for future in batch.futures:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            latency = time.time() - start_time
+            size = len(batch.prompts)
+            self.batches += 1
+            self.prompts += size
+            self.batch_sizes[size] = self.batch_sizes.get(size, 0) + 1
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+
+    async def post(self, url: str, payload: dict) -> dict:
+        session = await self.get_session()
+        async with session.post(url, json=payload) as r:
+            try:
+                res = await r.json(content_type=None)
+            except ValueError:
+                res = None
+
+            if r.status >= 400:
+                detail = r.reason
+                if isinstance(res, dict) and "error" in res:
+                    detail = res["error"]
+                raise EmbeddingError(r.status, f"Ollama: {detail}")
+            return res
+
+    async def send_embed(self, batch: EmbeddingBatch) -> Optional[list]:
+        payload = {**batch.extra, "model": batch.model, "input": batch.prompts}
+        try:
+            res = await self.post(f"{batch.url}/api/embed", payload)
+        except EmbeddingError as e:
+            if e.status == 404 and "model" not in e.detail:
+                # Older Ollama without /api/embed
+                return None
+            raise e
+        return res["embeddings"]
+
+    async def send_pipelined(self, batch: EmbeddingBatch) -> list:
+        async def embed_one(prompt):
+            payload = {**batch.extra, "model": batch.model, "prompt": prompt}
+            try:
+                res = await self.post(f"{batch.url}/api/embeddings", payload)
+                return res["embedding"]
+            except Exception as e:
+                return e
+
+        return await asyncio.gather(*[embed_one(prompt) for prompt in batch.prompts])
+
+    def to_dict(self) -> dict:
+        return {
+            "mode": self.mode,
+            "window": self.window,
+            "max_batch_size": self.max_batch_size,
+            "batches": self.batches,
+            "prompts": self.prompts,
+            "avg_batch_size": round(self.prompts / self.batches, 2)
+            if self.batches
+            else 0,
+            "batch_sizes": dict(sorted(self.batch_sizes.items())),
+            "avg_latency": round(self.total_latency / self.batches, 4)
+            if self.batches
+            else 0,
+            "max_latency": round(self.max_latency, 4),
+            "unsupported_backends": sorted(self.unsupported),
+        }
@@ -0,0 +1,202 @@
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional
+import asyncio
+import hashlib
+import json
+import time
+
+from apps.ollama.singleflight import SingleFlight
+
+
+class CacheEntry:
+    def __init__(self, value):
+        self.value = value
+        self.fetched_at = time.time()
+
+
+class MetadataCache:
+    """Short-lived cache for Ollama metadata responses.
+
+    Entries are fresh for ``ttl`` seconds. For another ``stale_ttl`` seconds
+    the stale value is returned right away while it is refreshed in the
+    background, so a slow Ollama only delays the first request. Fetches go
+    through ``single_flight``, so concurrent misses share one upstream call.
+    """
+
+    def __init__(
+        self,
+        ttl: float = 10,
+        stale_ttl: float = 300,
+        single_flight: Optional[SingleFlight] = None,
+    ):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.single_flight = single_flight or SingleFlight()
+        self.entries: Dict[Hashable, CacheEntry] = {}
+        # Bumped on invalidation so fetches started before it are neither
+        # stored nor shared with later callers
+        self.generation = 0
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    async def get(
+        self, key: Hashable, fetch: Callable[[], Awaitable], label: str = "default"
+    ):
+        if not self.enabled:
+            return await self.single_flight.do((self.generation, key), fetch, label)
+
+        entry = self.entries.get(key)
+        age = time.time() - entry.fetched_at if entry else None
+
+        if entry and age < self.ttl:
+            self.hits += 1
+            return entry.value
+
+        if entry and age < self.ttl + self.stale_ttl:
+            self.stale_hits += 1
+            self.refresh(key, fetch, label)
+            return entry.value
+
+        self.misses += 1
+        return await asyncio.shield(self.refresh(key, fetch, label))
+
+    def refresh(
+        self, key: Hashable, fetch: Callable[[], Awaitable], label: str = "default"
+    ) -> asyncio.Task:
+        generation = self.generation
+
+        async def run():
+            try:
+                value = await self.single_flight.do((generation, key), fetch, label)
+            except Exception as e:
+                print(f"Metadata cache refresh failed for {key}: {e}")
+                raise e
+
+            if generation == self.generation:
+                self.entries[key] = CacheEntry(value)
+            return value
+
+        task = asyncio.ensure_future(run())
+        # Background refresh errors are logged above, mark them retrieved
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return task
+
+    def invalidate(self):
+        self.generation += 1
+        self.entries.clear()
+
+    def to_dict(self) -> dict:
+        return {
+            "ttl": self.ttl,
+            "stale_ttl": self.stale_ttl,
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+        }
+
+
+def is_deterministic(payload: dict) -> bool:
+    options = payload.get("options")
+    if not isinstance(options, dict):
+        return False
+    return options.get("temperature") == 0 or options.get("seed") is not None
+
+
+def get_response_cache_key(payload: dict, digest: str) -> str:
+    # keep_alive only affects how long the model stays loaded, not the output
+    payload = {key: value for key, value in payload.items() if key != "keep_alive"}
+    body = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(f"{digest}:{body}".encode("utf-8")).hexdigest()
+
+
+class CachedResponse:
+    def __init__(self, status: int, media_type: Optional[str], chunks: List[bytes]):
+        self.status = status
+        self.media_type = media_type
+        # Kept exactly as received so a replay has the original framing
+        self.chunks = chunks
+        self.size = sum(len(chunk) for chunk in chunks)
+
+
+class ResponseRecorder:
+    def __init__(self, cache: "ResponseCache", key: str):
+        self.cache = cache
+        self.key = key
+        self.chunks: Optional[List[bytes]] = []
+        self.size = 0
+
+    def add(self, chunk: bytes):
+        if self.chunks is None:
+            return
+
+        self.size += len(chunk)
+        if self.size > self.cache.max_entry_size:
+            # Too large to cache, stop holding on to it
+            self.chunks = None
+        else:
+            self.chunks.append(chunk)
+
+    def save(self, status: int, media_type: Optional[str]):
+        if self.chunks is not None and status == 200:
+            self.cache.put(self.key, CachedResponse(status, media_type, self.chunks))
+
+
+class ResponseCache:
+    """LRU cache of complete generation responses, bounded by total size."""
+
+    def __init__(self, max_size: int, max_entry_size: int):
+        self.max_size = max_size
+        self.max_entry_size = max_entry_size
+        self.entries: "OrderedDict[str, CachedResponse]" = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key: str, entry: CachedResponse):
+        if entry.size > self.max_entry_size:
+            return
+
+        if key in self.entries:
+            self.size -= self.entries.pop(key).size
+        self.entries[key] = entry
+        self.size += entry.size
+
+        while self.size > self.max_size and self.entries:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= evicted.size
+            self.evictions += 1
+
+    def recorder(self, key: str) -> ResponseRecorder:
+        return ResponseRecorder(self, key)
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+    def to_dict(self) -> dict:
+        return {
+            "entries": len(self.entries),
+            "size": self.size,
+            "max_size": self.max_size,
+            "max_entry_size": self.max_entry_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
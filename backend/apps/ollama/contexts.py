@@ -0,0 +1,130 @@
+from collections import OrderedDict
+from typing import AsyncIterator, Optional, Tuple
+import json
+import time
+
+
+class ContextStore:
+    """/api/generate contexts kept server-side, keyed by user and a
+    client-chosen conversation handle.
+
+    Contexts are stored JSON-encoded, so they are spliced into the request
+    body without serializing the token array again. Entries unused for
+    ``ttl`` seconds expire, and the least recently used ones are evicted
+    once ``max_size`` bytes are stored.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries: "OrderedDict[Tuple[str, str], Tuple[bytes, float]]" = (
+            OrderedDict()
+        )
+        self.size = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, user_id: str, handle: str) -> Optional[bytes]:
+        key = (user_id, handle)
+        entry = self.entries.get(key)
+        if entry == None or time.time() - entry[1] > self.ttl:
+            if entry != None:
+                self.delete(user_id, handle)
+            self.misses += 1
+            return None
+
+        self.entries[key] = (entry[0], time.time())
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, user_id: str, handle: str, context: list):
+        self.delete(user_id, handle)
+
+        encoded = json.dumps(context, separators=(",", ":")).encode("utf-8")
+        if len(encoded) > self.max_size:
+            return
+
+        self.entries[(user_id, handle)] = (encoded, time.time())
+        self.size += len(encoded)
+
+        while self.size > self.max_size:
+            _, (evicted, _) = self.entries.popitem(last=False)
+            self.size -= len(evicted)
+            self.evictions += 1
+
+    def delete(self, user_id: str, handle: str) -> bool:
+        entry = self.entries.pop((user_id, handle), None)
+        if entry == None:
+            return False
+        self.size -= len(entry[0])
+        return True
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+    def to_dict(self) -> dict:
+        return {
+            "entries": len(self.entries),
+            "size": self.size,
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+def splice_context(body: bytes, context: bytes) -> bytes:
+    # body is a serialized JSON object without a "context" key
+    body = body.rstrip()
+    if body[:-1].strip() == b"{":
+        return b'{"context": ' + context + b"}"
+    return body[:-1] + b', "context": ' + context + b"}"
+
+
+class ContextCapture:
+    """Moves the context out of a /api/generate response into the store,
+    replacing it with the handle.
+
+    Only lines mentioning a context are parsed. Responses that are not
+    forwarded as whole lines are buffered until complete.
+    """
+
+    def __init__(self, store: ContextStore, user_id: str, handle: str):
+        self.store = store
+        self.user_id = user_id
+        self.handle = handle
+
+    def rewrite(self, content: bytes) -> bytes:
+        if b'"context"' not in content:
+            return content
+
+        lines = content.split(b"\n")
+        for idx, line in enumerate(lines):
+            if b'"context"' not in line:
+                continue
+            try:
+                data = json.loads(line)
+            except ValueError:
+                continue
+
+            if isinstance(data, dict) and isinstance(data.get("context"), list):
+                self.store.put(self.user_id, self.handle, data.pop("context"))
+                data["context_id"] = self.handle
+                lines[idx] = json.dumps(data).encode("utf-8")
+        return b"\n".join(lines)
+
+    async def rewrite_chunks(self, chunks: AsyncIterator[bytes], aligned: bool):
+        buffer = b""
+        async for chunk in chunks:
+            if aligned:
+                yield self.rewrite(chunk)
+            else:
+                buffer += chunk
+
+        if buffer:
+            yield self.rewrite(buffer)
@@ -0,0 +1,174 @@
+from typing import List, Optional, Union
+import json
+import time
+import uuid
+
+
+# Same keys the frontend keeps from the final frame of a response
+INFO_KEYS = [
+    "total_duration",
+    "load_duration",
+    "sample_count",
+    "sample_duration",
+    "prompt_eval_count",
+    "prompt_eval_duration",
+    "eval_count",
+    "eval_duration",
+]
+
+
+def get_thread(history: dict, message_id: Optional[str]) -> List[dict]:
+    """Messages from the root of the chat down to ``message_id``."""
+    thread = []
+    while message_id != None and message_id in history["messages"]:
+        message = history["messages"][message_id]
+        thread.append(message)
+        message_id = message.get("parentId")
+    return thread[::-1]
+
+
+def add_exchange(
+    history: dict,
+    parent_id: Optional[str],
+    user_message: dict,
+    model: str,
+    response_id: Optional[str] = None,
+):
+    """Add a user message and an empty assistant reply to the chat history.
+
+    A user message whose id is already in the history is reused, so several
+    models can answer the same message.
+    """
+    timestamp = int(time.time())
+
+    message_id = user_message.get("id") or str(uuid.uuid4())
+    if message_id in history["messages"]:
+        user_message = history["messages"][message_id]
+    else:
+        user_message = {
+            **user_message,
+            "id": message_id,
+            "parentId": parent_id,
+            "childrenIds": [],
+            "role": "user",
+            "timestamp": user_message.get("timestamp", timestamp),
+        }
+        history["messages"][message_id] = user_message
+        if parent_id != None:
+            history["messages"][parent_id]["childrenIds"].append(message_id)
+
+    response_message = {
+        "parentId": message_id,
+        "id": response_id or str(uuid.uuid4()),
+        "childrenIds": [],
+        "role": "assistant",
+        "content": "",
+        "model": model,
+        "timestamp": timestamp,
+    }
+    history["messages"][response_message["id"]] = response_message
+    user_message["childrenIds"].append(response_message["id"])
+    history["currentId"] = response_message["id"]
+
+    return user_message, response_message
+
+
+def merge_exchange(chat: dict, user_message: dict, response_message: dict) -> dict:
+    """Write one exchange into the latest stored version of a chat.
+
+    Only the messages of this exchange are replaced, so replies streamed
+    concurrently into the same chat do not overwrite each other.
+    """
+    history = chat.get("history") or {"messages": {}, "currentId": None}
+    messages = history.setdefault("messages", {})
+
+    def add_child(message_id, child_id):
+        if message_id in messages and child_id not in messages[message_id].get(
+            "childrenIds", []
+        ):
+            messages[message_id].setdefault("childrenIds", []).append(child_id)
+
+    if user_message["id"] not in messages:
+        messages[user_message["id"]] = {**user_message, "childrenIds": []}
+        add_child(user_message.get("parentId"), user_message["id"])
+    messages[response_message["id"]] = response_message
+    add_child(user_message["id"], response_message["id"])
+
+    history["currentId"] = response_message["id"]
+    chat["history"] = history
+    chat["messages"] = get_thread(history, response_message["id"])
+    return chat
+
+
+def get_chat_messages(thread: List[dict], system: Optional[str] = None) -> List[dict]:
+    """The /api/chat messages for a thread, built like the frontend does."""
+    messages = [{"role": "system", "content": system}] if system else []
+    for message in thread:
+        if message.get("deleted"):
+            continue
+
+        item = {"role": message["role"], "content": message.get("content", "")}
+        images = [
+            file["url"][file["url"].find(",") + 1 :]
+            for file in message.get("files") or []
+            if file.get("type") == "image" and isinstance(file.get("url"), str)
+        ]
+        if images:
+            item["images"] = images
+        messages.append(item)
+
+    # Only the last message with images keeps them
+    with_images = [idx for idx, item in enumerate(messages) if "images" in item]
+    for idx in with_images[:-1]:
+        del messages[idx]["images"]
+    return messages
+
+
+class ReplyRecorder:
+    """Builds the assistant message from the streamed /api/chat frames."""
+
+    def __init__(self, message: dict):
+        self.message = message
+        self.buffer = b""
+
+    def feed(self, chunk: Union[str, bytes]):
+        if isinstance(chunk, str):
+            chunk = chunk.encode("utf-8")
+
+        lines = (self.buffer + chunk).split(b"\n")
+        self.buffer = lines.pop()
+        for line in lines:
+            self.parse(line)
+
+    def close(self):
+        if self.buffer:
+            self.parse(self.buffer)
+            self.buffer = b""
+        self.message["done"] = True
+
+    def parse(self, line: bytes):
+        if not line.strip():
+            return
+        try:
+            data = json.loads(line)
+        except ValueError:
+            return
+        if not isinstance(data, dict):
+            return
+
+        error = data.get("detail") or data.get("error")
+        if error:
+            self.message["error"] = True
+            self.message["content"] = error
+        elif data.get("done") == False and isinstance(data.get("message"), dict):
+            content = data["message"].get("content", "")
+            if not (self.message["content"] == "" and content == "\n"):
+                self.message["content"] += content
+        elif data.get("done"):
+            self.message["done"] = True
+            if self.message["content"] == "":
+                self.message["error"] = True
+                self.message[
+                    "content"
+                ] = "Oops! No text generated from Ollama, Please try again."
+            self.message["info"] = {key: data.get(key) for key in INFO_KEYS}
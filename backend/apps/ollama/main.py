@@ -3,15 +3,90 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse
 from fastapi.concurrency import run_in_threadpool
 
-import requests
+import aiohttp
 import json
+import time
 import uuid
-from pydantic import BaseModel
+import asyncio
+from pydantic import BaseModel, ConfigDict
+from typing import List, Optional, Union
 
+from apps.web.models.chats import Chats
 from apps.web.models.users import Users
+from apps.rag.main import app as rag_app
+from apps.rag.utils import query_embeddings_collection, rag_template
+from apps.ollama.admission import (
+    AdmissionController,
+    QueueFullError,
+    INTERACTIVE,
+    BACKGROUND,
+    PRIORITIES,
+)
+from apps.ollama.cache import (
+    MetadataCache,
+    ResponseCache,
+    get_response_cache_key,
+    is_deterministic,
+)
+from apps.ollama.batching import EmbeddingBatcher, EmbeddingError
+from apps.ollama.contexts import ContextCapture, ContextStore, splice_context
+from apps.ollama.history import (
+    ReplyRecorder,
+    add_exchange,
+    get_chat_messages,
+    get_thread,
+    merge_exchange,
+)
+from apps.ollama.backends import BackendPool, OllamaBackend, normalize_model_name
+from apps.ollama.pulls import PullJob, PullManager
+from apps.ollama.registry import RequestRecord, RequestRegistry
+from apps.ollama.residency import ResidencyManager
+from apps.ollama.singleflight import SingleFlight
+from apps.ollama.telemetry import GenerationTelemetry
+from apps.ollama.transforms import (
+    DEFAULT_NUM_CTX,
+    add_system_prompt,
+    add_user_prefix,
+    apply_transforms,
+    transform_body,
+    truncate_history,
+)
 from constants import ERROR_MESSAGES
 from utils.utils import decode_token, get_current_user, get_admin_user
-from config import OLLAMA_BASE_URL, WEBUI_AUTH
+from utils.misc import align_lines
+from config import (
+    OLLAMA_BASE_URLS,
+    OLLAMA_HEALTH_CHECK_INTERVAL,
+    OLLAMA_POOL_MAXSIZE,
+    OLLAMA_POOL_KEEPALIVE,
+    OLLAMA_CONNECT_TIMEOUT,
+    OLLAMA_READ_TIMEOUT,
+    OLLAMA_REQUEST_TTL,
+    OLLAMA_MAX_CONCURRENT_REQUESTS,
+    OLLAMA_MAX_QUEUE_SIZE,
+    OLLAMA_MAX_QUEUE_PER_USER,
+    OLLAMA_METADATA_CACHE_TTL,
+    OLLAMA_METADATA_CACHE_STALE_TTL,
+    OLLAMA_RESPONSE_CACHE,
+    OLLAMA_RESPONSE_CACHE_MAX_SIZE,
+    OLLAMA_RESPONSE_CACHE_MAX_ENTRY_SIZE,
+    OLLAMA_EMBEDDING_BATCH_WINDOW,
+    OLLAMA_EMBEDDING_BATCH_SIZE,
+    OLLAMA_EMBEDDING_BATCH_MODE,
+    OLLAMA_CONTEXT_STORE_MAX_SIZE,
+    OLLAMA_CONTEXT_STORE_TTL,
+    OLLAMA_CHAT_SAVE_INTERVAL,
+    OLLAMA_HISTORY_TRUNCATION,
+    OLLAMA_HISTORY_TOKEN_BUDGETS,
+    OLLAMA_HISTORY_RESPONSE_RESERVE,
+    OLLAMA_RESIDENT_MODELS,
+    OLLAMA_RESIDENCY_MEMORY_BUDGET,
+    OLLAMA_RESIDENCY_KEEP_ALIVE,
+    OLLAMA_RESIDENCY_INTERVAL,
+    OLLAMA_SYSTEM_PROMPT,
+    OLLAMA_USER_PREFIX,
+    WEBUI_AUTH,
+)
 
 app = FastAPI()
 app.add_middleware(
@@ -22,17 +97,98 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-app.state.OLLAMA_BASE_URL = OLLAMA_BASE_URL
+app.state.OLLAMA_BASE_URLS = OLLAMA_BASE_URLS
+app.state.SYSTEM_PROMPT = OLLAMA_SYSTEM_PROMPT
+app.state.USER_PREFIX = OLLAMA_USER_PREFIX
+app.state.RESPONSE_CACHE = OLLAMA_RESPONSE_CACHE
 
 # TARGET_SERVER_URL = OLLAMA_API_BASE_URL
 
 
-REQUEST_POOL = []
+REQUEST_REGISTRY = RequestRegistry(ttl=OLLAMA_REQUEST_TTL)
+BACKEND_POOL = BackendPool(
+    OLLAMA_BASE_URLS, health_check_interval=OLLAMA_HEALTH_CHECK_INTERVAL
+)
+SINGLE_FLIGHT = SingleFlight()
+PULLS = PullManager()
+TELEMETRY = GenerationTelemetry()
+RESIDENCY = ResidencyManager(
+    max_models=OLLAMA_RESIDENT_MODELS,
+    memory_budget=int(OLLAMA_RESIDENCY_MEMORY_BUDGET * 1024**3),
+    keep_alive=OLLAMA_RESIDENCY_KEEP_ALIVE,
+    interval=OLLAMA_RESIDENCY_INTERVAL,
+)
+TELEMETRY.listeners.append(
+    lambda labels, data: RESIDENCY.record_load(
+        labels["model"],
+        data["load_duration"] / 1e9
+        if isinstance(data.get("load_duration"), (int, float))
+        else None,
+    )
+)
+METADATA_CACHE = MetadataCache(
+    ttl=OLLAMA_METADATA_CACHE_TTL,
+    stale_ttl=OLLAMA_METADATA_CACHE_STALE_TTL,
+    single_flight=SINGLE_FLIGHT,
+)
+RESPONSE_CACHE = ResponseCache(
+    max_size=int(OLLAMA_RESPONSE_CACHE_MAX_SIZE * 1024 * 1024),
+    max_entry_size=int(OLLAMA_RESPONSE_CACHE_MAX_ENTRY_SIZE * 1024 * 1024),
+)
+CONTEXT_STORE = ContextStore(
+    max_size=int(OLLAMA_CONTEXT_STORE_MAX_SIZE * 1024 * 1024),
+    ttl=OLLAMA_CONTEXT_STORE_TTL,
+)
+ADMISSION = AdmissionController(
+    max_concurrent=OLLAMA_MAX_CONCURRENT_REQUESTS,
+    max_queue_size=OLLAMA_MAX_QUEUE_SIZE,
+    max_queue_per_user=OLLAMA_MAX_QUEUE_PER_USER,
+)
+
+# Created lazily, aiohttp sessions must be bound to the running event loop
+SESSION: Optional[aiohttp.ClientSession] = None
+
+
+async def get_session() -> aiohttp.ClientSession:
+    global SESSION
+
+    if SESSION is None or SESSION.closed:
+        SESSION = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=OLLAMA_POOL_MAXSIZE,
+                keepalive_timeout=OLLAMA_POOL_KEEPALIVE,
+            ),
+            timeout=aiohttp.ClientTimeout(
+                total=None,
+                connect=OLLAMA_CONNECT_TIMEOUT,
+                sock_read=OLLAMA_READ_TIMEOUT,
+            ),
+        )
+    return SESSION
+
+
+EMBEDDING_BATCHER = EmbeddingBatcher(
+    get_session,
+    window=OLLAMA_EMBEDDING_BATCH_WINDOW,
+    max_batch_size=OLLAMA_EMBEDDING_BATCH_SIZE,
+    mode=OLLAMA_EMBEDDING_BATCH_MODE,
+)
+
+
+async def close_session():
+    global SESSION
+
+    BACKEND_POOL.stop()
+    RESIDENCY.stop()
+    PULLS.stop()
+    if SESSION is not None:
+        await SESSION.close()
+        SESSION = None
 
 
 @app.get("/url")
 async def get_ollama_api_url(user=Depends(get_admin_user)):
-    return {"OLLAMA_BASE_URL": app.state.OLLAMA_BASE_URL}
+    return {"OLLAMA_BASE_URL": app.state.OLLAMA_BASE_URLS[0]}
 
 
 class UrlUpdateForm(BaseModel):
@@ -41,130 +197,211 @@ class UrlUpdateForm(BaseModel):
 
 @app.post("/url/update")
 async def update_ollama_api_url(form_data: UrlUpdateForm, user=Depends(get_admin_user)):
-    app.state.OLLAMA_BASE_URL = form_data.url
-    return {"OLLAMA_BASE_URL": app.state.OLLAMA_BASE_URL}
+    app.state.OLLAMA_BASE_URLS = [form_data.url]
+    BACKEND_POOL.set_urls(app.state.OLLAMA_BASE_URLS)
+    return {"OLLAMA_BASE_URL": app.state.OLLAMA_BASE_URLS[0]}
 
 
-@app.get("/cancel/{request_id}")
-async def cancel_ollama_request(request_id: str, user=Depends(get_current_user)):
-    if user:
-        if request_id in REQUEST_POOL:
-            REQUEST_POOL.remove(request_id)
-        return True
-    else:
-        raise HTTPException(status_code=401, detail=ERROR_MESSAGES.ACCESS_PROHIBITED)
+@app.get("/urls")
+async def get_ollama_api_urls(user=Depends(get_admin_user)):
+    return {"OLLAMA_BASE_URLS": app.state.OLLAMA_BASE_URLS}
 
 
-# HOTFIX: FUNCTIONS FOR ADDING PROMPT ENGINEERING TO BODY
-def add_system_prompt(body, custom_content="Sample Content"):
-    try:
-        import json
+class UrlsUpdateForm(BaseModel):
+    urls: List[str]
 
-        # Check if body is a bytes object, if so, decode it
-        if isinstance(body, bytes):
-            body = body.decode("utf-8")
 
-        # Convert string to dictionary if necessary
-        if isinstance(body, str):
-            body = json.loads(body)
+@app.post("/urls/update")
+async def update_ollama_api_urls(
+    form_data: UrlsUpdateForm, user=Depends(get_admin_user)
+):
+    urls = [url.strip() for url in form_data.urls if url.strip()]
+    if not urls:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=ERROR_MESSAGES.INCORRECT_FORMAT(),
+        )
 
-        # Proceed only if body is a dictionary and has 'messages'
-        if isinstance(body, dict) and "messages" in body:
-            messages = body["messages"]
-            new_message = {"role": "system", "content": custom_content}
-            messages.insert(0, new_message)
-            body["messages"] = messages
+    app.state.OLLAMA_BASE_URLS = urls
+    BACKEND_POOL.set_urls(app.state.OLLAMA_BASE_URLS)
+    return {"OLLAMA_BASE_URLS": app.state.OLLAMA_BASE_URLS}
 
-        # Convert the dictionary back to JSON and encode to bytes before returning
-        return json.dumps(body).encode("utf-8")
 
-    except Exception as e:
-        # In case of any error, return the input as it is
-        if isinstance(body, dict):
-            return json.dumps(body).encode(
-                "utf-8"
-            )  # Return as bytes if input was initially a dict
-        elif isinstance(body, bytes):
-            return body  # Return original bytes object
-        elif isinstance(body, str):
-            return body.encode(
-                "utf-8"
-            )  # Return as bytes if input was initially a string
-        else:
-            return str(body).encode(
-                "utf-8"
-            )  # Return string representation of the input encoded as bytes if it's neither
+@app.get("/backends")
+async def get_ollama_backends(user=Depends(get_admin_user)):
+    return [backend.to_dict() for backend in BACKEND_POOL.backends]
 
 
-def add_prefix_to_user_messages(body, prefix="Sample Prefix: "):
-    try:
-        import json
+@app.get("/queue")
+async def get_queue_status(user=Depends(get_admin_user)):
+    return ADMISSION.to_dict()
 
-        # Check if body is a bytes object, if so, decode it
-        if isinstance(body, bytes):
-            body = body.decode("utf-8")
 
-        # Convert string to dictionary if necessary
-        if isinstance(body, str):
-            body = json.loads(body)
+class QueueSettingsForm(BaseModel):
+    max_concurrent: int
+    max_queue_size: int
+    max_queue_per_user: int
 
-        # Proceed only if body is a dictionary and has 'messages'
-        if isinstance(body, dict) and "messages" in body:
-            for message in body["messages"]:
-                # Check if the message is from a user and prepend the prefix
-                if message.get("role") == "user":
-                    message["content"] = prefix + message["content"]
 
-        # Convert the dictionary back to JSON and encode to bytes before returning
-        return json.dumps(body).encode("utf-8")
+@app.post("/queue/update")
+async def update_queue_settings(
+    form_data: QueueSettingsForm, user=Depends(get_admin_user)
+):
+    ADMISSION.set_limits(
+        form_data.max_concurrent,
+        form_data.max_queue_size,
+        form_data.max_queue_per_user,
+    )
+    return ADMISSION.to_dict()
 
-    except Exception as e:
-        # In case of any error, return the input as it is
-        if isinstance(body, dict):
-            return json.dumps(body).encode(
-                "utf-8"
-            )  # Return as bytes if input was initially a dict
-        elif isinstance(body, bytes):
-            return body  # Return original bytes object
-        elif isinstance(body, str):
-            return body.encode(
-                "utf-8"
-            )  # Return as bytes if input was initially a string
-        else:
-            return str(body).encode(
-                "utf-8"
-            )  # Return string representation of the input encoded as bytes if it's neither
 
+def get_cache_status():
+    return {
+        "metadata": METADATA_CACHE.to_dict(),
+        "responses": {
+            "enabled": app.state.RESPONSE_CACHE,
+            **RESPONSE_CACHE.to_dict(),
+        },
+        "contexts": CONTEXT_STORE.to_dict(),
+    }
 
-@app.api_route("/{path:path}", methods=["GET", "POST", "PUT", "DELETE"])
-async def proxy(path: str, request: Request, user=Depends(get_current_user)):
-    target_url = f"{app.state.OLLAMA_BASE_URL}/{path}"
 
-    body = await request.body()
+@app.get("/cache")
+async def get_cache_settings(user=Depends(get_admin_user)):
+    return get_cache_status()
+
+
+class CacheSettingsForm(BaseModel):
+    response_cache: bool
+
+
+@app.post("/cache/update")
+async def update_cache_settings(
+    form_data: CacheSettingsForm, user=Depends(get_admin_user)
+):
+    app.state.RESPONSE_CACHE = form_data.response_cache
+    if not app.state.RESPONSE_CACHE:
+        RESPONSE_CACHE.clear()
+    return get_cache_status()
+
+
+@app.post("/cache/clear")
+async def clear_cache(user=Depends(get_admin_user)):
+    METADATA_CACHE.invalidate()
+    RESPONSE_CACHE.clear()
+    return get_cache_status()
+
+
+@app.get("/metrics")
+async def get_metrics(user=Depends(get_admin_user)):
+    return {
+        "single_flight": SINGLE_FLIGHT.to_dict(),
+        "embedding_batches": EMBEDDING_BATCHER.to_dict(),
+        "generation": TELEMETRY.to_dict(),
+        "residency": RESIDENCY.to_dict(),
+    }
+
+
+@app.get("/prompt/settings")
+async def get_prompt_settings(user=Depends(get_admin_user)):
+    return {
+        "system_prompt": app.state.SYSTEM_PROMPT,
+        "user_prefix": app.state.USER_PREFIX,
+    }
+
+
+class PromptSettingsForm(BaseModel):
+    system_prompt: Optional[str] = None
+    user_prefix: Optional[str] = None
+
+
+@app.post("/prompt/settings/update")
+async def update_prompt_settings(
+    form_data: PromptSettingsForm, user=Depends(get_admin_user)
+):
+    # An empty string disables the transform, None restores the default
+    app.state.SYSTEM_PROMPT = (
+        form_data.system_prompt
+        if form_data.system_prompt != None
+        else OLLAMA_SYSTEM_PROMPT
+    )
+    app.state.USER_PREFIX = (
+        form_data.user_prefix if form_data.user_prefix != None else OLLAMA_USER_PREFIX
+    )
+    return {
+        "system_prompt": app.state.SYSTEM_PROMPT,
+        "user_prefix": app.state.USER_PREFIX,
+    }
+
+
+@app.get("/cancel/{request_id}")
+async def cancel_ollama_request(request_id: str, user=Depends(get_current_user)):
+    record = REQUEST_REGISTRY.get(request_id)
+    if record == None:
+        return False
+
+    if record.user_id != user.id and user.role != "admin":
+        raise HTTPException(status_code=401, detail=ERROR_MESSAGES.ACCESS_PROHIBITED)
+
+    return REQUEST_REGISTRY.cancel(request_id)
+
+
+@app.delete("/contexts/{context_id}")
+async def delete_ollama_context(context_id: str, user=Depends(get_current_user)):
+    return CONTEXT_STORE.delete(user.id, context_id)
+
+
+@app.get("/requests")
+async def get_ollama_requests(user=Depends(get_admin_user)):
+    REQUEST_REGISTRY.sweep()
+    return [record.to_dict() for record in REQUEST_REGISTRY.list()]
+
 
-    # HOTFIX: ADD PROMPT ENGINEERING TO BODY
-    custom_system_prompt = """
-You are designed exclusively for creating personalized nutrition plans for patients based on their specific health conditions and dietary needs. Upon receiving a patient's data, including their health conditions, allergies, and dietary preferences, you will generate a balanced diet plan tailored to their requirements. You should STRICTLY adhere to the following strict guidelines:
-I REPEAT - STRICTLY ADHERE TO THE FOLLOWING GUIDELINES:
-- IMPORTANT: You should only respond to requests related to creating personalized nutrition plans. 
-- IMPORTANT: If asked about any other topic, you must explicitly REFUSE to ANSWER, stating that responding to such queries is against your policy
-- If the necessary patient data is not provided in the request, you WILL ASK for this data before proceeding.
-- You will NEVER make assumptions or deductions without receiving specific patient data. This is to ensure the safety and well-being of the patients involved.
+@app.get("/pulls")
+async def get_ollama_pulls(user=Depends(get_admin_user)):
+    return [job.to_dict() for job in PULLS.list()]
 
-By adhering to these guidelines, you should ensure that you provide accurate, safe, and legally compliant dietary recommendations to patients.
-"""
 
-    custom_user_prefix = """
-I'll tell you the following about myself, please say "This is off-topic" if this is out of your domain, else respond to my queries.
-"""
+@app.get("/pulls/events")
+async def get_ollama_pull_events(
+    name: str, url_idx: int = 0, user=Depends(get_admin_user)
+):
+    # Server-sent progress of a running (or recently finished) pull
+    try:
+        backend = BACKEND_POOL.get(url_idx)
+    except IndexError:
+        backend = None
+
+    job = PULLS.get(backend.url, normalize_model_name(name)) if backend else None
+    if job == None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=ERROR_MESSAGES.NOT_FOUND,
+        )
+
+    return StreamingResponse(
+        stream_pull(job, sse=True),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
 
-    body = add_system_prompt(body, custom_system_prompt)
-    body = add_prefix_to_user_messages(body, custom_user_prefix)
 
-    headers = dict(request.headers)
+def get_endpoint(path: str) -> str:
+    # The frontend calls /ollama/api/api/<endpoint>, older clients /ollama/api/<endpoint>
+    return path[len("api/") :] if path.startswith("api/") else path
 
+
+# Endpoints that change the set of models on a backend
+MODEL_MANAGEMENT_ENDPOINTS = ["pull", "delete", "push", "copy", "create"]
+# Read-only metadata endpoints served from METADATA_CACHE
+METADATA_ENDPOINTS = {"tags": "GET", "version": "GET", "ps": "GET", "show": "POST"}
+# Idempotent endpoints whose identical concurrent requests share one upstream call
+COALESCED_ENDPOINTS = {"embeddings": "POST"}
+
+
+def check_user_access(path: str, user):
     if user.role in ["user", "admin"]:
-        if path in ["pull", "delete", "push", "copy", "create"]:
+        if get_endpoint(path) in MODEL_MANAGEMENT_ENDPOINTS:
             if user.role != "admin":
                 raise HTTPException(
                     status_code=status.HTTP_401_UNAUTHORIZED,
@@ -176,76 +413,931 @@ I'll tell you the following about myself, please say "This is off-topic" if this
             detail=ERROR_MESSAGES.ACCESS_PROHIBITED,
         )
 
-    headers.pop("host", None)
-    headers.pop("authorization", None)
-    headers.pop("origin", None)
-    headers.pop("referer", None)
 
+# Not forwarded: the body may be rewritten and aiohttp decodes transfer/content encodings
+EXCLUDED_HEADERS = [
+    "host",
+    "authorization",
+    "origin",
+    "referer",
+    "content-length",
+    "transfer-encoding",
+    "content-encoding",
+    "connection",
+]
+
+
+def get_priority(endpoint: str, payload: Optional[dict], headers) -> str:
+    # Forwarded headers are a plain dict with lowercase keys
+    priority = headers.get("x-request-priority", "").lower()
+    if priority in PRIORITIES:
+        return priority
+
+    # Non-streamed generate calls are housekeeping such as chat title generation
+    if endpoint == "generate" and payload and payload.get("stream") == False:
+        return BACKGROUND
+    return INTERACTIVE
+
+
+# Streamed responses that are forwarded one complete line at a time
+LINE_ALIGNED_CONTENT_TYPES = ["application/x-ndjson", "text/event-stream"]
+
+
+def get_transforms():
+    transforms = []
+    if app.state.SYSTEM_PROMPT:
+        transforms.append(add_system_prompt(app.state.SYSTEM_PROMPT))
+    if app.state.USER_PREFIX:
+        transforms.append(add_user_prefix(app.state.USER_PREFIX))
+    return transforms
+
+
+async def open_upstream(
+    backend: OllamaBackend, path: str, method: str, body: bytes, headers: dict
+) -> aiohttp.ClientResponse:
     r = None
+    try:
+        session = await get_session()
+        BACKEND_POOL.start(get_session)
+        RESIDENCY.start(maintain_residency)
+
+        r = await session.request(
+            method=method,
+            url=f"{backend.url}/{path}",
+            data=body,
+            headers=headers,
+        )
+
+        if r.status >= 400:
+            error_detail = f"Ollama: {r.reason}"
+            try:
+                res = await r.json(content_type=None)
+                if "error" in res:
+                    error_detail = f"Ollama: {res['error']}"
+            except:
+                pass
+            finally:
+                r.release()
+
+            raise HTTPException(status_code=r.status, detail=error_detail)
+        return r
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        print(e)
+        if r is not None:
+            r.close()
+        raise HTTPException(
+            status_code=500,
+            detail="Open WebUI: Server Connection Error",
+        )
+
+
+async def wait_for_slot(ticket, record) -> bool:
+    # A cancelled request gives up its place in the queue and is never granted
+    while not await ticket.wait(timeout=1):
+        if record.cancelled:
+            return False
+    return True
+
+
+async def run_preemptible(ticket, record, backend, path, method, body, headers):
+    async def attempt():
+        r = await open_upstream(backend, path, method, body, headers)
+        record.response = r
+        try:
+            return r, await r.read()
+        except aiohttp.ClientError as e:
+            print(e)
+            raise HTTPException(
+                status_code=500,
+                detail="Open WebUI: Server Connection Error",
+            )
+        finally:
+            r.close()
+
+    # Read the whole response, starting over whenever the slot is pre-empted
+    while True:
+        if not await wait_for_slot(ticket, record):
+            raise HTTPException(
+                status_code=status.HTTP_408_REQUEST_TIMEOUT,
+                detail=ERROR_MESSAGES.DEFAULT("Request cancelled"),
+            )
+
+        task = asyncio.ensure_future(attempt())
+        preempted = asyncio.ensure_future(ticket.preempted.wait())
+        try:
+            await asyncio.wait([task, preempted], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            preempted.cancel()
+            if not task.done():
+                task.cancel()
+
+        if task.done() and not task.cancelled():
+            return task.result()
+        print(f"Pre-empted background request {record.id}")
+
+
+async def get_models() -> List[dict]:
+    # The tag list as served by the proxy, merged across backends
+    _, content, _ = await METADATA_CACHE.get(
+        ("tags", None, b""),
+        lambda: fetch_response("api/tags", "GET", b"", {}, None),
+        label="tags",
+    )
+    return json.loads(content).get("models", [])
+
+
+async def get_model_digest(model: Optional[str]) -> Optional[str]:
+    if not model:
+        return None
+
+    try:
+        models = await get_models()
+    except Exception as e:
+        print(e)
+        return None
+
+    model = normalize_model_name(model)
+    for item in models:
+        if item.get("name") == model:
+            return item.get("digest")
+    return None
+
+
+async def get_model_num_ctx(model: str) -> Optional[int]:
+    # Set with PARAMETER num_ctx in the Modelfile, listed by /api/show
+    body = json.dumps({"name": model}).encode("utf-8")
+    try:
+        _, content, _ = await METADATA_CACHE.get(
+            ("show", None, body),
+            lambda: fetch_response("api/show", "POST", body, {}, None),
+            label="show",
+        )
+        parameters = json.loads(content).get("parameters") or ""
+    except Exception as e:
+        print(e)
+        return None
+
+    for line in parameters.splitlines():
+        parts = line.split()
+        if len(parts) == 2 and parts[0] == "num_ctx" and parts[1].isdigit():
+            return int(parts[1])
+    return None
+
+
+async def get_history_budget(payload: dict) -> int:
+    model = payload.get("model")
+    if not isinstance(model, str):
+        return 0
+
+    budgets = {
+        normalize_model_name(name): budget
+        for name, budget in OLLAMA_HISTORY_TOKEN_BUDGETS.items()
+    }
+    if normalize_model_name(model) in budgets:
+        return budgets[normalize_model_name(model)]
+
+    options = payload.get("options") if isinstance(payload.get("options"), dict) else {}
+    num_ctx = options.get("num_ctx")
+    if not isinstance(num_ctx, int) or num_ctx <= 0:
+        num_ctx = await get_model_num_ctx(model) or DEFAULT_NUM_CTX
+
+    # Leave room for the reply, or Ollama shifts the prompt out while generating
+    reserve = options.get("num_predict")
+    if not isinstance(reserve, int) or reserve <= 0:
+        reserve = OLLAMA_HISTORY_RESPONSE_RESERVE
+    return max(num_ctx - reserve, num_ctx // 2)
+
+
+async def compact_history(payload: dict, user) -> bool:
+    """Fit the chat history in the model's context window, returns whether
+    messages were dropped."""
+    if not OLLAMA_HISTORY_TRUNCATION or not isinstance(payload.get("messages"), list):
+        return False
+
+    budget = await get_history_budget(payload)
+    messages, tokens = truncate_history(payload, budget)
+    if not messages:
+        return False
+
+    print(
+        f"Dropped {messages} messages (~{tokens} tokens) of history for {payload['model']}"
+    )
+    TELEMETRY.observe(
+        "history_tokens_dropped",
+        tokens,
+        {"model": payload["model"], "user": user.id},
+    )
+    return True
+
+
+async def replay_response(cached, stream: bool):
+    if stream:
+        yield json.dumps({"id": str(uuid.uuid4()), "done": False}) + "\n"
+    for chunk in cached.chunks:
+        yield chunk
+
+
+async def forward_request(
+    path: str,
+    method: str,
+    body: bytes,
+    headers: dict,
+    user,
+    payload: Optional[dict] = None,
+    backend: Optional[OllamaBackend] = None,
+    context_id: Optional[str] = None,
+):
+    endpoint = get_endpoint(path)
+
+    if backend == None:
+        backend = BACKEND_POOL.select(payload.get("model") if payload else None)
+
+    headers = {
+        key: value
+        for key, value in headers.items()
+        if key.lower() not in EXCLUDED_HEADERS
+    }
+
+    stream = (
+        endpoint in ["generate", "chat"]
+        and payload != None
+        and not ("stream" in payload and payload["stream"] == False)
+    )
+
+    # Deterministic requests are answered from the response cache without a slot
+    recorder = None
+    if (
+        app.state.RESPONSE_CACHE
+        and endpoint in ["generate", "chat"]
+        and payload != None
+        and context_id == None
+        and is_deterministic(payload)
+    ):
+        digest = await get_model_digest(payload.get("model"))
+        if digest:
+            key = get_response_cache_key(payload, digest)
+            cached = None
+            if "no-cache" not in headers.get("cache-control", ""):
+                cached = RESPONSE_CACHE.get(key)
+
+            if cached:
+                return StreamingResponse(
+                    replay_response(cached, stream),
+                    status_code=cached.status,
+                    media_type=cached.media_type,
+                )
+            recorder = RESPONSE_CACHE.recorder(key)
+
+    # Generation takes a slot on the backend, or waits for one in the fair queue.
+    # Background requests that are not streamed are buffered here, so they can
+    # be restarted when an interactive request needs their slot.
+    ticket = None
+    if endpoint in ["generate", "chat"]:
+        priority = get_priority(endpoint, payload, headers)
+        try:
+            ticket = ADMISSION.acquire(
+                backend.url,
+                user.id,
+                priority=priority,
+                preemptible=priority == BACKGROUND and not stream,
+            )
+        except QueueFullError as e:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail=ERROR_MESSAGES.QUEUE_FULL,
+                headers={"Retry-After": str(e.retry_after)},
+            )
+
+    backend.outstanding += 1
+    record = REQUEST_REGISTRY.register(
+        RequestRecord(
+            id=str(uuid.uuid4()),
+            user_id=user.id,
+            model=payload.get("model") if payload else None,
+            endpoint=endpoint,
+            backend=backend.url,
+        )
+    )
+
+    finished = False
+
+    def finish():
+        nonlocal finished
+        if finished:
+            return
+        finished = True
 
-    def get_request():
-        nonlocal r
+        if ticket:
+            ADMISSION.release(ticket)
+        backend.outstanding -= 1
+        REQUEST_REGISTRY.remove(record.id)
+
+        if endpoint in MODEL_MANAGEMENT_ENDPOINTS:
+            METADATA_CACHE.invalidate()
+
+    # Also called when the request is cancelled or swept from the registry
+    record.release = finish
+
+    def observe():
+        if endpoint not in ["generate", "chat"]:
+            return None
+
+        RESIDENCY.record(record.model)
+        queue_time = ticket.granted_at - ticket.enqueued_at if ticket else None
+        return TELEMETRY.stream(record.model, backend.url, user.id, queue_time)
+
+    capture = ContextCapture(CONTEXT_STORE, user.id, context_id) if context_id else None
+
+    async def relay(r: aiohttp.ClientResponse, observer=None):
+        chunks = r.content.iter_any()
+        aligned = r.content_type in LINE_ALIGNED_CONTENT_TYPES
+        if aligned:
+            # Forward whole frames, so clients never see a line split across chunks
+            chunks = align_lines(chunks)
+        if capture:
+            chunks = capture.rewrite_chunks(chunks, aligned)
 
-        request_id = str(uuid.uuid4())
         try:
-            REQUEST_POOL.append(request_id)
+            async for chunk in chunks:
+                if record.cancelled:
+                    break
+                if recorder:
+                    recorder.add(chunk)
+                yield chunk
+                # Parsed once the chunk has been passed on, so it is not held up
+                if observer:
+                    observer.feed(chunk)
+            else:
+                if recorder:
+                    recorder.save(r.status, r.content_type)
+                if observer:
+                    observer.close()
+        except aiohttp.ClientError as e:
+            # Raised when the stream is cancelled while waiting on the next chunk
+            if not record.cancelled:
+                raise e
+        finally:
+            if record.cancelled:
+                print("User: canceled request")
+            r.close()
+
+    if ticket and not ticket.granted and stream:
+        # Answer right away and report the queue position until a slot frees up
+        async def queued_content():
+            try:
+                position = ADMISSION.position(ticket)
+                yield json.dumps(
+                    {"id": record.id, "done": False, "queue_position": position}
+                ) + "\n"
+
+                while not await ticket.wait(timeout=1):
+                    if record.cancelled:
+                        return
+                    if ADMISSION.position(ticket) != position:
+                        position = ADMISSION.position(ticket)
+                        yield json.dumps(
+                            {"id": record.id, "done": False, "queue_position": position}
+                        ) + "\n"
+
+                if record.cancelled:
+                    return
 
-            def stream_content():
+                observer = observe()
                 try:
-                    if path == "generate":
-                        data = json.loads(body.decode("utf-8"))
-
-                        if not ("stream" in data and data["stream"] == False):
-                            yield json.dumps({"id": request_id, "done": False}) + "\n"
-
-                    elif path == "chat":
-                        yield json.dumps({"id": request_id, "done": False}) + "\n"
-
-                    for chunk in r.iter_content(chunk_size=8192):
-                        if request_id in REQUEST_POOL:
-                            yield chunk
-                        else:
-                            print("User: canceled request")
-                            break
-                finally:
-                    if hasattr(r, "close"):
-                        r.close()
-                        if request_id in REQUEST_POOL:
-                            REQUEST_POOL.remove(request_id)
-
-            r = requests.request(
-                method=request.method,
-                url=target_url,
-                data=body,
-                headers=headers,
-                stream=True,
+                    r = await open_upstream(backend, path, method, body, headers)
+                except HTTPException as e:
+                    yield json.dumps({"detail": e.detail}) + "\n"
+                    return
+
+                record.response = r
+                async for chunk in relay(r, observer):
+                    yield chunk
+            finally:
+                finish()
+
+        return StreamingResponse(queued_content(), media_type="application/x-ndjson")
+
+    if ticket and ticket.preemptible:
+        try:
+            r, content = await run_preemptible(
+                ticket, record, backend, path, method, body, headers
             )
+        finally:
+            finish()
 
-            r.raise_for_status()
+        if capture:
+            content = capture.rewrite(content)
+        if recorder:
+            recorder.add(content)
+            recorder.save(r.status, r.content_type)
+        observer = observe()
+        if observer:
+            # Timed from the grant of the attempt that was not pre-empted
+            observer.start_time = ticket.granted_at
+            observer.feed(content)
+            observer.close()
 
-            # r.close()
+        return Response(
+            content=content,
+            status_code=r.status,
+            headers={
+                key: value
+                for key, value in r.headers.items()
+                if key.lower() not in EXCLUDED_HEADERS
+            },
+        )
 
-            return StreamingResponse(
-                stream_content(),
-                status_code=r.status_code,
-                headers=dict(r.headers),
+    try:
+        if ticket and not await wait_for_slot(ticket, record):
+            raise HTTPException(
+                status_code=status.HTTP_408_REQUEST_TIMEOUT,
+                detail=ERROR_MESSAGES.DEFAULT("Request cancelled"),
             )
-        except Exception as e:
-            raise e
+        observer = observe()
+        r = await open_upstream(backend, path, method, body, headers)
+    except BaseException as e:
+        finish()
+        raise e
+    record.response = r
+
+    async def stream_content():
+        try:
+            if stream:
+                yield json.dumps({"id": record.id, "done": False}) + "\n"
+
+            async for chunk in relay(r, observer):
+                yield chunk
+        finally:
+            finish()
+
+    return StreamingResponse(
+        stream_content(),
+        status_code=r.status,
+        headers={
+            key: value
+            for key, value in r.headers.items()
+            if key.lower() not in EXCLUDED_HEADERS
+        },
+    )
+
+
+async def preload_model(model: str, keep_alive=None, backend=None) -> bool:
+    # A generate request without a prompt only loads the model into memory
+    payload = {"model": model}
+    if keep_alive is not None:
+        payload["keep_alive"] = keep_alive
+
+    if backend == None:
+        backend = BACKEND_POOL.select(model)
 
     try:
-        return await run_in_threadpool(get_request)
+        session = await get_session()
+        async with session.post(f"{backend.url}/api/generate", json=payload) as r:
+            r.raise_for_status()
+            return True
     except Exception as e:
-        error_detail = "Open WebUI: Server Connection Error"
-        if r is not None:
+        print(e)
+        return False
+
+
+async def maintain_residency():
+    sizes = {model["name"]: model.get("size", 0) for model in await get_models()}
+    RESIDENCY.resident = RESIDENCY.plan(sizes)
+
+    for model in RESIDENCY.resident:
+        backend = BACKEND_POOL.select(model)
+        # Reloads an evicted model, or just restarts the keep_alive timer
+        if model in backend.loaded_models:
+            RESIDENCY.refreshes += 1
+        else:
+            RESIDENCY.preloads += 1
+        await preload_model(model, RESIDENCY.keep_alive, backend)
+
+
+async def prewarm_model(model: str) -> bool:
+    # Chats can also use OpenAI/LiteLLM models, only load what Ollama serves
+    try:
+        names = [item["name"] for item in await get_models()]
+    except Exception as e:
+        print(e)
+        return False
+    if normalize_model_name(model) not in names:
+        return False
+
+    RESIDENCY.prewarms += 1
+    return await preload_model(
+        model, RESIDENCY.keep_alive if RESIDENCY.enabled else None
+    )
+
+
+# Keeps references to running pre-warm tasks so they are not garbage collected
+PREWARM_TASKS = set()
+
+
+def schedule_prewarm(model: str):
+    task = asyncio.create_task(prewarm_model(model))
+    PREWARM_TASKS.add(task)
+    task.add_done_callback(PREWARM_TASKS.discard)
+
+
+async def run_pull(job: PullJob, backend: OllamaBackend, path: str, payload: dict):
+    body = json.dumps({**payload, "stream": True}).encode("utf-8")
+    try:
+        r = await open_upstream(
+            backend, path, "POST", body, {"Content-Type": "application/json"}
+        )
+    except HTTPException as e:
+        job.publish({"error": e.detail})
+        return
+
+    try:
+        async for chunk in align_lines(r.content.iter_any()):
+            for line in chunk.split(b"\n"):
+                if not line.strip():
+                    continue
+                try:
+                    job.publish(json.loads(line))
+                except ValueError:
+                    pass
+    finally:
+        r.close()
+        METADATA_CACHE.invalidate()
+
+
+async def stream_pull(job: PullJob, sse: bool = False):
+    # Leaving early only unsubscribes, the pull itself keeps running
+    queue = job.subscribe()
+    try:
+        while True:
+            frame = await queue.get()
+            if frame == None:
+                break
+
+            line = json.dumps(frame)
+            yield f"data: {line}\n\n" if sse else f"{line}\n"
+    finally:
+        job.unsubscribe(queue)
+
+
+async def pull_model(path: str, payload: dict, backend: OllamaBackend):
+    name = normalize_model_name(payload.get("name") or payload.get("model"))
+    job = PULLS.start(
+        backend.url, name, lambda job: run_pull(job, backend, path, payload)
+    )
+
+    if payload.get("stream") == False:
+        frame = None
+        async for line in stream_pull(job):
+            frame = json.loads(line)
+            if "error" in frame:
+                raise HTTPException(status_code=500, detail=frame["error"])
+        return frame
+
+    return StreamingResponse(stream_pull(job), media_type="application/x-ndjson")
+
+
+class RAGChatForm(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    model: str
+    messages: List[dict]
+    collection_names: List[str] = []
+    k: Optional[int] = None
+    keep_alive: Optional[Union[int, str]] = None
+
+
+@app.post("/rag/chat")
+async def generate_rag_chat_completion(
+    form_data: RAGChatForm, request: Request, user=Depends(get_current_user)
+):
+    check_user_access("chat", user)
+
+    payload = form_data.model_dump(exclude_none=True)
+    collection_names = payload.pop("collection_names")
+    k = payload.pop("k", None)
+
+    user_messages = [m for m in form_data.messages if m.get("role") == "user"]
+    query = user_messages[-1].get("content", "") if user_messages else ""
+
+    backend = BACKEND_POOL.select(form_data.model)
+
+    if collection_names and query:
+        # Retrieval and model load are independent, so overlap them
+        context, _ = await asyncio.gather(
+            run_in_threadpool(
+                query_embeddings_collection,
+                collection_names=collection_names,
+                query=query,
+                k=k if k else rag_app.state.TOP_K,
+                embedding_function=rag_app.state.sentence_transformer_ef,
+            ),
+            preload_model(form_data.model, form_data.keep_alive, backend),
+        )
+
+        user_messages[-1]["content"] = rag_template(
+            rag_app.state.RAG_TEMPLATE,
+            " ".join(context["documents"][0]),
+            query,
+        )
+        payload["messages"] = form_data.messages
+
+    payload = apply_transforms(payload, get_transforms())
+    await compact_history(payload, user)
+    body = json.dumps(payload).encode("utf-8")
+
+    return await forward_request(
+        "api/chat", "POST", body, request.headers, user, payload, backend
+    )
+
+
+class ChatMessageForm(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    model: str
+    message: dict
+    parent_id: Optional[str] = None
+    response_id: Optional[str] = None
+    system: Optional[str] = None
+
+
+def save_exchange(
+    chat_id: str, user_id: str, user_message: dict, response_message: dict
+):
+    # Merged into the latest stored chat, it may have changed since it was read
+    chat = Chats.get_chat_by_id_and_user_id(chat_id, user_id)
+    if chat == None:
+        return
+    Chats.update_chat_by_id(
+        chat_id, merge_exchange(json.loads(chat.chat), user_message, response_message)
+    )
+
+
+@app.post("/chats/{chat_id}/messages")
+async def generate_chat_message(
+    chat_id: str,
+    form_data: ChatMessageForm,
+    request: Request,
+    user=Depends(get_current_user),
+):
+    # Only the new message is sent, the history comes from the stored chat and
+    # the reply is written back to it as it streams
+    check_user_access("chat", user)
+
+    chat = Chats.get_chat_by_id_and_user_id(chat_id, user.id)
+    if chat == None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail=ERROR_MESSAGES.ACCESS_PROHIBITED,
+        )
+
+    history = json.loads(chat.chat).get("history") or {
+        "messages": {},
+        "currentId": None,
+    }
+    parent_id = (
+        form_data.parent_id
+        if form_data.parent_id != None
+        else form_data.message.get("parentId", history.get("currentId"))
+    )
+    if parent_id != None and parent_id not in history["messages"]:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=ERROR_MESSAGES.NOT_FOUND,
+        )
+
+    user_message, response_message = add_exchange(
+        history, parent_id, form_data.message, form_data.model, form_data.response_id
+    )
+    thread = get_thread(history, user_message["id"])
+
+    payload = form_data.model_dump(exclude_none=True)
+    for key in ["message", "parent_id", "response_id", "system", "stream"]:
+        payload.pop(key, None)
+    payload["messages"] = get_chat_messages(thread, form_data.system)
+    payload = apply_transforms(payload, get_transforms())
+    await compact_history(payload, user)
+    body = json.dumps(payload).encode("utf-8")
+
+    save_exchange(chat_id, user.id, user_message, response_message)
+
+    try:
+        response = await forward_request(
+            "api/chat", "POST", body, request.headers, user, payload
+        )
+    except HTTPException as e:
+        response_message.update({"content": e.detail, "error": True, "done": True})
+        save_exchange(chat_id, user.id, user_message, response_message)
+        raise e
+
+    recorder = ReplyRecorder(response_message)
+    if not isinstance(response, StreamingResponse):
+        recorder.feed(response.body)
+        recorder.close()
+        save_exchange(chat_id, user.id, user_message, response_message)
+        return response
+
+    async def record_reply(chunks):
+        saved_at = time.time()
+        try:
+            async for chunk in chunks:
+                yield chunk
+                recorder.feed(chunk)
+                if time.time() - saved_at >= OLLAMA_CHAT_SAVE_INTERVAL:
+                    save_exchange(chat_id, user.id, user_message, response_message)
+                    saved_at = time.time()
+        finally:
+            # Also keeps what was generated when the client goes away
+            recorder.close()
+            save_exchange(chat_id, user.id, user_message, response_message)
+
+    response.body_iterator = record_reply(response.body_iterator)
+    return response
+
+
+async def get_merged_models():
+    session = await get_session()
+    BACKEND_POOL.start(get_session)
+
+    async def get_models(backend):
+        try:
+            async with session.get(f"{backend.url}/api/tags") as r:
+                r.raise_for_status()
+                return (await r.json()).get("models", [])
+        except Exception as e:
+            print(e)
+            return None
+
+    responses = await asyncio.gather(
+        *[get_models(backend) for backend in BACKEND_POOL.backends]
+    )
+    if all(models == None for models in responses):
+        raise HTTPException(
+            status_code=500,
+            detail="Open WebUI: Server Connection Error",
+        )
+
+    merged = {}
+    for idx, models in enumerate(responses):
+        for model in models or []:
+            if model["name"] not in merged:
+                merged[model["name"]] = {**model, "urls": []}
+            merged[model["name"]]["urls"].append(idx)
+
+    return {"models": list(merged.values())}
+
+
+async def fetch_response(
+    path: str, method: str, body: bytes, headers, backend: Optional[OllamaBackend]
+):
+    endpoint = get_endpoint(path)
+    if endpoint == "tags" and backend == None and len(BACKEND_POOL.backends) > 1:
+        models = await get_merged_models()
+        return 200, json.dumps(models).encode("utf-8"), "application/json"
+
+    if backend == None:
+        model = None
+        if body:
             try:
-                res = r.json()
-                if "error" in res:
-                    error_detail = f"Ollama: {res['error']}"
-            except:
-                error_detail = f"Ollama: {e}"
+                payload = json.loads(body)
+                model = payload.get("model") or payload.get("name")
+            except Exception:
+                pass
+        backend = BACKEND_POOL.select(model)
 
+    headers = {
+        key: value
+        for key, value in headers.items()
+        if key.lower() not in EXCLUDED_HEADERS
+    }
+    r = await open_upstream(backend, path, method, body, headers)
+    try:
+        return r.status, await r.read(), r.content_type
+    except aiohttp.ClientError as e:
+        print(e)
+        raise HTTPException(
+            status_code=500,
+            detail="Open WebUI: Server Connection Error",
+        )
+    finally:
+        r.close()
+
+
+def get_batchable_embedding_payload(body: bytes) -> Optional[dict]:
+    try:
+        payload = json.loads(body)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+    if (
+        isinstance(payload, dict)
+        and isinstance(payload.get("model"), str)
+        and isinstance(payload.get("prompt"), str)
+        and set(payload.keys()) <= {"model", "prompt", "options", "keep_alive"}
+    ):
+        return payload
+    return None
+
+
+async def fetch_batched_embedding(payload: dict, backend: Optional[OllamaBackend]):
+    if backend == None:
+        backend = BACKEND_POOL.select(payload["model"])
+
+    extra = {
+        key: value for key, value in payload.items() if key not in ["model", "prompt"]
+    }
+    try:
+        embedding = await EMBEDDING_BATCHER.embed(
+            backend.url, payload["model"], payload["prompt"], extra
+        )
+    except EmbeddingError as e:
+        raise HTTPException(status_code=e.status, detail=e.detail)
+    except Exception as e:
+        print(e)
         raise HTTPException(
-            status_code=r.status_code if r else 500,
-            detail=error_detail,
+            status_code=500,
+            detail="Open WebUI: Server Connection Error",
+        )
+
+    content = json.dumps({"embedding": embedding}).encode("utf-8")
+    return 200, content, "application/json"
+
+
+@app.api_route("/{path:path}", methods=["GET", "POST", "PUT", "DELETE"])
+async def proxy(path: str, request: Request, user=Depends(get_current_user)):
+    check_user_access(path, user)
+    endpoint = get_endpoint(path)
+
+    body = await request.body()
+
+    payload = None
+    context_id = None
+    if endpoint in ["chat", "generate"]:
+        payload, body = transform_body(body, get_transforms())
+
+        # Serialized again only when history was dropped
+        if (
+            endpoint == "chat"
+            and payload != None
+            and await compact_history(payload, user)
+        ):
+            body = json.dumps(payload).encode("utf-8")
+
+        # The context of a generate conversation can be kept here, see CONTEXT_STORE
+        if endpoint == "generate" and payload != None and "context_id" in payload:
+            context_id = str(payload.pop("context_id"))
+            body = json.dumps(payload).encode("utf-8")
+            if "context" not in payload:
+                context = CONTEXT_STORE.get(user.id, context_id)
+                if context != None:
+                    body = splice_context(body, context)
+
+    # Model management goes to one backend, chosen with ?url_idx= (default the first)
+    backend = None
+    if endpoint in MODEL_MANAGEMENT_ENDPOINTS or "url_idx" in request.query_params:
+        try:
+            backend = BACKEND_POOL.get(int(request.query_params.get("url_idx", 0)))
+        except (ValueError, IndexError):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=ERROR_MESSAGES.NOT_FOUND,
+            )
+
+    # Concurrent pulls of the same tag share one upstream download
+    if endpoint == "pull" and request.method == "POST":
+        try:
+            pull_payload = json.loads(body)
+        except ValueError:
+            pull_payload = None
+        if isinstance(pull_payload, dict) and (
+            pull_payload.get("name") or pull_payload.get("model")
+        ):
+            return await pull_model(path, pull_payload, backend)
+
+    key = (endpoint, backend.url if backend else None, body)
+
+    async def fetch():
+        if endpoint == "embeddings" and EMBEDDING_BATCHER.enabled:
+            embedding_payload = get_batchable_embedding_payload(body)
+            if embedding_payload:
+                return await fetch_batched_embedding(embedding_payload, backend)
+        return await fetch_response(
+            path, request.method, body, request.headers, backend
         )
+
+    if METADATA_ENDPOINTS.get(endpoint) == request.method:
+        status_code, content, media_type = await METADATA_CACHE.get(
+            key, fetch, label=endpoint
+        )
+        return Response(content=content, status_code=status_code, media_type=media_type)
+
+    if COALESCED_ENDPOINTS.get(endpoint) == request.method:
+        status_code, content, media_type = await SINGLE_FLIGHT.do(
+            key, fetch, label=endpoint
+        )
+        return Response(content=content, status_code=status_code, media_type=media_type)
+
+    return await forward_request(
+        path, request.method, body, request.headers, user, payload, backend, context_id
+    )
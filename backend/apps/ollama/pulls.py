@@ -0,0 +1,118 @@
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Set, Tuple
+import asyncio
+import time
+
+
+class PullJob:
+    """One upstream pull, shared by every client pulling the same tag.
+
+    Progress frames are broadcast to all subscribers. The latest frame per
+    layer digest (plus the latest plain status) is kept, so a client joining
+    late starts from the current progress instead of the full history.
+    """
+
+    def __init__(self, url: str, name: str):
+        self.url = url
+        self.name = name
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.state: "OrderedDict[str, dict]" = OrderedDict()
+        self.subscribers: Set[asyncio.Queue] = set()
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def done(self) -> bool:
+        return self.finished_at is not None
+
+    def publish(self, frame: dict):
+        key = frame.get("digest") or "status"
+        self.state.pop(key, None)
+        self.state[key] = frame
+
+        for queue in self.subscribers:
+            queue.put_nowait(frame)
+
+    def finish(self):
+        self.finished_at = time.time()
+        for queue in self.subscribers:
+            queue.put_nowait(None)
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue()
+        for frame in self.state.values():
+            queue.put_nowait(frame)
+
+        if self.done:
+            queue.put_nowait(None)
+        else:
+            self.subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self.subscribers.discard(queue)
+
+    def to_dict(self) -> dict:
+        return {
+            "url": self.url,
+            "name": self.name,
+            "started_at": int(self.started_at),
+            "finished_at": int(self.finished_at) if self.finished_at else None,
+            "subscribers": len(self.subscribers),
+            "status": self.state.get("status"),
+            "layers": [frame for key, frame in self.state.items() if key != "status"],
+        }
+
+
+class PullManager:
+    """Runs at most one upstream pull per backend and model tag.
+
+    A pull keeps running when its clients disconnect. Finished pulls are
+    kept for ``retention`` seconds so a refreshed page still sees the result.
+    """
+
+    def __init__(self, retention: float = 300):
+        self.retention = retention
+        self.jobs: Dict[Tuple[str, str], PullJob] = {}
+
+    def sweep(self):
+        now = time.time()
+        for key, job in list(self.jobs.items()):
+            if job.done and now - job.finished_at > self.retention:
+                del self.jobs[key]
+
+    def get(self, url: str, name: str) -> Optional[PullJob]:
+        self.sweep()
+        return self.jobs.get((url, name))
+
+    def start(
+        self, url: str, name: str, run: Callable[[PullJob], Awaitable]
+    ) -> PullJob:
+        """Return the running pull for this tag, or start one with ``run``."""
+        job = self.get(url, name)
+        if job is not None and not job.done:
+            return job
+
+        job = PullJob(url, name)
+        self.jobs[(url, name)] = job
+
+        async def run_job():
+            try:
+                await run(job)
+            except Exception as e:
+                print(e)
+                job.publish({"error": str(e) or e.__class__.__name__})
+            finally:
+                job.finish()
+
+        job.task = asyncio.create_task(run_job())
+        return job
+
+    def list(self):
+        self.sweep()
+        return list(self.jobs.values())
+
+    def stop(self):
+        for job in self.jobs.values():
+            if job.task is not None:
+                job.task.cancel()
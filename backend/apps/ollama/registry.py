@@ -0,0 +1,96 @@
+from typing import Callable, Dict, List, Optional
+import time
+
+
+class RequestRecord:
+    def __init__(
+        self,
+        id: str,
+        user_id: str,
+        model: Optional[str],
+        endpoint: str,
+        backend: Optional[str] = None,
+        response=None,
+        release: Optional[Callable[[], None]] = None,
+    ):
+        self.id = id
+        self.user_id = user_id
+        self.model = model
+        self.endpoint = endpoint
+        self.backend = backend
+        self.response = response
+        # Frees the admission slot and backend count; must be safe to call twice
+        self.release = release
+        self.start_time = time.time()
+        self.cancelled = False
+
+    def close(self):
+        if self.response is not None:
+            self.response.close()
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "user_id": self.user_id,
+            "model": self.model,
+            "endpoint": self.endpoint,
+            "backend": self.backend,
+            "start_time": int(self.start_time),
+            "duration": round(time.time() - self.start_time, 3),
+            "cancelled": self.cancelled,
+        }
+
+
+class RequestRegistry:
+    """In-flight proxied requests keyed by id.
+
+    Entries are removed when their stream finishes; anything still present
+    after ``ttl`` seconds (e.g. a response that was never consumed) is
+    closed, released and dropped by ``sweep``.
+    """
+
+    def __init__(self, ttl: float = 3600, sweep_interval: float = 60):
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self.last_sweep = time.time()
+        self.requests: Dict[str, RequestRecord] = {}
+
+    def register(self, record: RequestRecord) -> RequestRecord:
+        self.requests[record.id] = record
+        if time.time() - self.last_sweep > self.sweep_interval:
+            self.sweep()
+        return record
+
+    def get(self, id: str) -> Optional[RequestRecord]:
+        return self.requests.get(id)
+
+    def remove(self, id: str):
+        self.requests.pop(id, None)
+
+    def cancel(self, id: str) -> bool:
+        record = self.requests.pop(id, None)
+        if record is None:
+            return False
+
+        # Closing the upstream connection makes Ollama stop generating right away
+        record.cancelled = True
+        record.close()
+        # The stream that would release the slot may never run, e.g. when the
+        # client went away before the response body was iterated
+        if record.release is not None:
+            record.release()
+        return True
+
+    def sweep(self) -> int:
+        self.last_sweep = time.time()
+        expired = [
+            record
+            for record in self.requests.values()
+            if self.last_sweep - record.start_time > self.ttl
+        ]
+        for record in expired:
+            self.cancel(record.id)
+        return len(expired)
+
+    def list(self) -> List[RequestRecord]:
+        return list(self.requests.values())
@@ -0,0 +1,136 @@
+from typing import Awaitable, Callable, Dict, List, Optional
+import asyncio
+import math
+import time
+
+from apps.ollama.backends import normalize_model_name
+
+
+# A warm model still reports a few milliseconds of load_duration
+COLD_START_THRESHOLD = 0.5
+
+
+class ResidencyManager:
+    """Keeps the most requested models loaded in Ollama.
+
+    Request rates are exponentially decayed counters with a ``half_life`` in
+    seconds. Every ``interval`` seconds the top ``max_models`` models that fit
+    in ``memory_budget`` bytes (0 for no limit) are preloaded, or have their
+    keep_alive refreshed if they are already resident.
+    """
+
+    def __init__(
+        self,
+        max_models: int = 0,
+        memory_budget: int = 0,
+        keep_alive: str = "30m",
+        interval: float = 60,
+        half_life: float = 600,
+    ):
+        self.max_models = max_models
+        self.memory_budget = memory_budget
+        self.keep_alive = keep_alive
+        self.interval = interval
+        self.half_life = half_life
+        self.task: Optional[asyncio.Task] = None
+
+        self.scores: Dict[str, float] = {}
+        self.updated_at: Dict[str, float] = {}
+        self.resident: List[str] = []
+        self.preloads = 0
+        self.refreshes = 0
+        self.prewarms = 0
+        # Requests and cold starts, split by whether residency was enabled
+        self.requests = {"enabled": 0, "disabled": 0}
+        self.cold_starts = {"enabled": 0, "disabled": 0}
+        self.model_cold_starts: Dict[str, int] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_models > 0
+
+    def get_score(self, model: str, now: Optional[float] = None) -> float:
+        now = now or time.time()
+        if model not in self.scores:
+            return 0.0
+        decay = math.pow(0.5, (now - self.updated_at[model]) / self.half_life)
+        return self.scores[model] * decay
+
+    def record(self, model: Optional[str]):
+        if not model:
+            return
+
+        model = normalize_model_name(model)
+        now = time.time()
+        self.scores[model] = self.get_score(model, now) + 1
+        self.updated_at[model] = now
+        self.requests["enabled" if self.enabled else "disabled"] += 1
+
+    def record_load(self, model: Optional[str], load_duration: Optional[float]):
+        if not model or load_duration is None:
+            return
+
+        if load_duration >= COLD_START_THRESHOLD:
+            model = normalize_model_name(model)
+            self.cold_starts["enabled" if self.enabled else "disabled"] += 1
+            self.model_cold_starts[model] = self.model_cold_starts.get(model, 0) + 1
+
+    def plan(self, sizes: Dict[str, int]) -> List[str]:
+        """Models to keep resident, hottest first, given their sizes in bytes."""
+        now = time.time()
+        ranked = sorted(
+            (model for model in self.scores if model in sizes),
+            key=lambda model: self.get_score(model, now),
+            reverse=True,
+        )
+
+        models = []
+        total = 0
+        for model in ranked:
+            if len(models) >= self.max_models:
+                break
+            if self.memory_budget and total + sizes[model] > self.memory_budget:
+                continue
+            models.append(model)
+            total += sizes[model]
+        return models
+
+    def start(self, maintain: Callable[[], Awaitable]):
+        if not self.enabled or (self.task is not None and not self.task.done()):
+            return
+
+        async def run():
+            while True:
+                await asyncio.sleep(self.interval)
+                try:
+                    await maintain()
+                except Exception as e:
+                    print(e)
+
+        self.task = asyncio.create_task(run())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    def to_dict(self) -> dict:
+        now = time.time()
+        return {
+            "max_models": self.max_models,
+            "memory_budget": self.memory_budget,
+            "keep_alive": self.keep_alive,
+            "resident": self.resident,
+            "rates": {
+                model: round(self.get_score(model, now), 3)
+                for model in sorted(
+                    self.scores, key=lambda m: self.get_score(m, now), reverse=True
+                )
+            },
+            "preloads": self.preloads,
+            "refreshes": self.refreshes,
+            "prewarms": self.prewarms,
+            "requests": self.requests,
+            "cold_starts": self.cold_starts,
+            "model_cold_starts": self.model_cold_starts,
+        }
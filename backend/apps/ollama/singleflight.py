@@ -0,0 +1,43 @@
+from typing import Awaitable, Callable, Dict, Hashable
+import asyncio
+
+
+class SingleFlight:
+    """Share one in-flight call between concurrent callers with the same key.
+
+    Results are returned to every caller as-is, so they must not be mutated.
+    """
+
+    def __init__(self):
+        self.calls: Dict[Hashable, asyncio.Task] = {}
+        self.executed: Dict[str, int] = {}
+        self.coalesced: Dict[str, int] = {}
+
+    async def do(
+        self, key: Hashable, fn: Callable[[], Awaitable], label: str = "default"
+    ):
+        task = self.calls.get(key)
+        if task is not None:
+            self.coalesced[label] = self.coalesced.get(label, 0) + 1
+        else:
+            self.executed[label] = self.executed.get(label, 0) + 1
+            task = asyncio.ensure_future(fn())
+            self.calls[key] = task
+
+            def done(task):
+                if self.calls.get(key) is task:
+                    del self.calls[key]
+                # Mark the error retrieved even if every caller went away
+                task.cancelled() or task.exception()
+
+            task.add_done_callback(done)
+
+        # Shielded so one caller going away does not cancel the call for the others
+        return await asyncio.shield(task)
+
+    def to_dict(self) -> dict:
+        return {
+            "in_flight": len(self.calls),
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+        }
@@ -0,0 +1,164 @@
+from typing import Callable, Dict, List, Optional
+import json
+import time
+
+from utils.histogram import (
+    SECONDS_BUCKETS,
+    TOKENS_BUCKETS,
+    TOKENS_PER_SECOND_BUCKETS,
+    Histogram,
+)
+
+
+METRICS = {
+    # Time spent waiting for an admission slot
+    "queue_time": SECONDS_BUCKETS,
+    # Upstream request sent -> first byte back
+    "ttfb": SECONDS_BUCKETS,
+    # Upstream request sent -> first generated token
+    "ttft": SECONDS_BUCKETS,
+    "load_duration": SECONDS_BUCKETS,
+    "prompt_eval_duration": SECONDS_BUCKETS,
+    "prompt_eval_count": TOKENS_BUCKETS,
+    "prompt_tokens_per_second": TOKENS_PER_SECOND_BUCKETS,
+    "eval_count": TOKENS_BUCKETS,
+    "tokens_per_second": TOKENS_PER_SECOND_BUCKETS,
+    "total_duration": SECONDS_BUCKETS,
+    # Estimated chat history tokens dropped to fit the context window
+    "history_tokens_dropped": TOKENS_BUCKETS,
+}
+
+
+class GenerationTelemetry:
+    """Histograms of generation metrics, broken down by model, backend and
+    user separately (not by their combination) to keep the label count low."""
+
+    def __init__(self):
+        # metric -> dimension -> label value -> histogram
+        self.histograms: Dict[str, Dict[str, Dict[str, Histogram]]] = {
+            name: {} for name in METRICS
+        }
+        self.requests = 0
+        # Called with (labels, frame) for the final frame of every response
+        self.listeners: List[Callable[[Dict[str, str], dict], None]] = []
+
+    def observe(self, name: str, value: Optional[float], labels: Dict[str, str]):
+        if value is None:
+            return
+
+        for dimension, label in {"all": "all", **labels}.items():
+            histograms = self.histograms[name].setdefault(dimension, {})
+            if label not in histograms:
+                histograms[label] = Histogram(METRICS[name])
+            histograms[label].observe(value)
+
+    def stream(
+        self,
+        model: Optional[str],
+        backend: str,
+        user_id: str,
+        queue_time: Optional[float] = None,
+    ) -> "StreamObserver":
+        self.requests += 1
+        labels = {"model": model or "unknown", "backend": backend, "user": user_id}
+        self.observe("queue_time", queue_time, labels)
+        return StreamObserver(self, labels)
+
+    def to_dict(self) -> dict:
+        return {
+            "requests": self.requests,
+            "metrics": {
+                name: {
+                    dimension: {
+                        label: histogram.to_dict()
+                        for label, histogram in histograms.items()
+                    }
+                    for dimension, histograms in dimensions.items()
+                }
+                for name, dimensions in self.histograms.items()
+            },
+        }
+
+
+class StreamObserver:
+    """Parses the NDJSON frames of one response as they are forwarded.
+
+    ``feed`` is meant to be called after a chunk has been passed on, so
+    parsing never delays delivery. Only an incomplete trailing line is held.
+    """
+
+    def __init__(self, telemetry: GenerationTelemetry, labels: Dict[str, str]):
+        self.telemetry = telemetry
+        self.labels = labels
+        self.start_time = time.time()
+        self.first_byte = False
+        self.first_token = False
+        self.buffer = b""
+
+    def feed(self, chunk: bytes):
+        if not self.first_byte:
+            self.first_byte = True
+            self.observe("ttfb", time.time() - self.start_time)
+
+        if self.buffer:
+            chunk = self.buffer + chunk
+
+        lines = chunk.split(b"\n")
+        self.buffer = lines.pop()
+        for line in lines:
+            self.parse(line)
+
+    def close(self):
+        # Non-streamed responses have no trailing newline
+        if self.buffer:
+            self.parse(self.buffer)
+            self.buffer = b""
+
+    def observe(self, name: str, value: Optional[float]):
+        self.telemetry.observe(name, value, self.labels)
+
+    def parse(self, line: bytes):
+        if not line.strip():
+            return
+
+        try:
+            data = json.loads(line)
+        except ValueError:
+            return
+        if not isinstance(data, dict):
+            return
+
+        if not self.first_token:
+            content = data.get("response") or (data.get("message") or {}).get("content")
+            if content or data.get("done"):
+                self.first_token = True
+                self.observe("ttft", time.time() - self.start_time)
+
+        if data.get("done"):
+            self.parse_stats(data)
+            for listener in self.telemetry.listeners:
+                listener(self.labels, data)
+
+    def parse_stats(self, data: dict):
+        # Ollama reports durations in nanoseconds
+        def seconds(key):
+            value = data.get(key)
+            return value / 1e9 if isinstance(value, (int, float)) else None
+
+        eval_count = data.get("eval_count")
+        eval_duration = seconds("eval_duration")
+        prompt_eval_count = data.get("prompt_eval_count")
+        prompt_eval_duration = seconds("prompt_eval_duration")
+
+        self.observe("load_duration", seconds("load_duration"))
+        self.observe("total_duration", seconds("total_duration"))
+        self.observe("eval_count", eval_count)
+        self.observe("prompt_eval_count", prompt_eval_count)
+        self.observe("prompt_eval_duration", prompt_eval_duration)
+
+        if eval_count and eval_duration:
+            self.observe("tokens_per_second", eval_count / eval_duration)
+        if prompt_eval_count and prompt_eval_duration:
+            self.observe(
+                "prompt_tokens_per_second", prompt_eval_count / prompt_eval_duration
+            )
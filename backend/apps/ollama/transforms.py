@@ -0,0 +1,127 @@
+from typing import Callable, List, Optional, Tuple
+import json
+
+
+# A transform takes the parsed request body and returns it, usually modified in place
+Transform = Callable[[dict], dict]
+
+
+def add_system_prompt(system_prompt: str) -> Transform:
+    def transform(payload: dict) -> dict:
+        if isinstance(payload.get("messages"), list):
+            payload["messages"].insert(0, {"role": "system", "content": system_prompt})
+        return payload
+
+    return transform
+
+
+def add_user_prefix(prefix: str) -> Transform:
+    def transform(payload: dict) -> dict:
+        if isinstance(payload.get("messages"), list):
+            for message in payload["messages"]:
+                # Malformed messages are left for Ollama to reject
+                if not isinstance(message, dict):
+                    continue
+                if message.get("role") == "user" and isinstance(
+                    message.get("content"), str
+                ):
+                    message["content"] = prefix + message["content"]
+        return payload
+
+    return transform
+
+
+# Rough token counts: about four characters per token, a few tokens of
+# framing per message, and a fixed cost per image for multimodal models
+CHARS_PER_TOKEN = 4
+MESSAGE_TOKENS = 4
+IMAGE_TOKENS = 768
+
+# Ollama's num_ctx when neither the request nor the Modelfile sets one
+DEFAULT_NUM_CTX = 2048
+
+
+def estimate_tokens(message: dict) -> int:
+    tokens = MESSAGE_TOKENS
+    if isinstance(message.get("content"), str):
+        tokens += -(-len(message["content"]) // CHARS_PER_TOKEN)
+    if isinstance(message.get("images"), list):
+        tokens += IMAGE_TOKENS * len(message["images"])
+    return tokens
+
+
+def truncate_history(payload: dict, budget: int) -> Tuple[int, int]:
+    """Drop the oldest turns of a chat until its messages fit in ``budget`` tokens.
+
+    System messages and the latest message are always kept, the remaining
+    budget goes to the most recent turns. Returns the number of messages and
+    the estimated number of tokens dropped.
+    """
+    messages = payload.get("messages")
+    if not isinstance(messages, list) or budget <= 0:
+        return 0, 0
+    # Malformed messages are left for Ollama to reject
+    if not all(isinstance(message, dict) for message in messages):
+        return 0, 0
+
+    tokens = [estimate_tokens(message) for message in messages]
+    if sum(tokens) <= budget:
+        return 0, 0
+
+    keep = {
+        idx for idx, message in enumerate(messages) if message.get("role") == "system"
+    }
+    keep.add(len(messages) - 1)
+    used = sum(tokens[idx] for idx in keep)
+
+    for idx in range(len(messages) - 2, -1, -1):
+        if idx in keep:
+            continue
+        if used + tokens[idx] > budget:
+            break
+        keep.add(idx)
+        used += tokens[idx]
+
+    kept = sorted(keep)
+    # A reply without the message it answers only confuses the model
+    for idx in kept[:-1]:
+        if messages[idx].get("role") == "system":
+            continue
+        if messages[idx].get("role") == "assistant":
+            keep.discard(idx)
+            used -= tokens[idx]
+        break
+
+    payload["messages"] = [
+        message for idx, message in enumerate(messages) if idx in keep
+    ]
+    return len(messages) - len(payload["messages"]), sum(tokens) - used
+
+
+def apply_transforms(payload: dict, transforms: List[Transform]) -> dict:
+    for transform in transforms:
+        payload = transform(payload)
+    return payload
+
+
+def transform_body(
+    body: bytes, transforms: List[Transform]
+) -> Tuple[Optional[dict], bytes]:
+    """Parse the body once, run every transform and serialize once.
+
+    Returns the transformed payload alongside the new body, or ``None`` and
+    the untouched body when it is not a JSON object.
+    """
+    try:
+        payload = json.loads(body)
+    except (ValueError, UnicodeDecodeError):
+        return None, body
+
+    if not isinstance(payload, dict):
+        return None, body
+
+    if not transforms:
+        return payload, body
+
+    payload = apply_transforms(payload, transforms)
+    return payload, json.dumps(payload).encode("utf-8")
@@ -2,12 +2,15 @@ from fastapi import FastAPI, Request, Response, HTTPException, Depends
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse, JSONResponse, FileResponse
 
-import requests
+import aiohttp
+import asyncio
 import json
 from pydantic import BaseModel
+from typing import Optional
 
 
 from apps.web.models.users import Users
+from apps.openai.ratelimit import RETRY_STATUSES, RateLimiter, RateLimitError
 from constants import ERROR_MESSAGES
 from utils.utils import (
     decode_token,
@@ -15,7 +18,19 @@ from utils.utils import (
     get_verified_user,
     get_admin_user,
 )
-from config import OPENAI_API_BASE_URL, OPENAI_API_KEY, CACHE_DIR
+from utils.misc import align_lines
+from config import (
+    OPENAI_API_BASE_URL,
+    OPENAI_API_KEY,
+    OPENAI_POOL_MAXSIZE,
+    OPENAI_POOL_KEEPALIVE,
+    OPENAI_CONNECT_TIMEOUT,
+    OPENAI_READ_TIMEOUT,
+    OPENAI_MAX_QUEUE_WAIT,
+    OPENAI_MAX_RETRIES,
+    OPENAI_MAX_RETRY_DELAY,
+    CACHE_DIR,
+)
 
 import hashlib
 from pathlib import Path
@@ -32,6 +47,41 @@ app.add_middleware(
 app.state.OPENAI_API_BASE_URL = OPENAI_API_BASE_URL
 app.state.OPENAI_API_KEY = OPENAI_API_KEY
 
+RATE_LIMITER = RateLimiter(
+    max_wait=OPENAI_MAX_QUEUE_WAIT,
+    max_retries=OPENAI_MAX_RETRIES,
+    max_retry_delay=OPENAI_MAX_RETRY_DELAY,
+)
+
+# Created lazily, aiohttp sessions must be bound to the running event loop
+SESSION: Optional[aiohttp.ClientSession] = None
+
+
+async def get_session() -> aiohttp.ClientSession:
+    global SESSION
+
+    if SESSION is None or SESSION.closed:
+        SESSION = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=OPENAI_POOL_MAXSIZE,
+                keepalive_timeout=OPENAI_POOL_KEEPALIVE,
+            ),
+            timeout=aiohttp.ClientTimeout(
+                total=None,
+                connect=OPENAI_CONNECT_TIMEOUT,
+                sock_read=OPENAI_READ_TIMEOUT,
+            ),
+        )
+    return SESSION
+
+
+async def close_session():
+    global SESSION
+
+    if SESSION is not None:
+        await SESSION.close()
+        SESSION = None
+
 
 class UrlUpdateForm(BaseModel):
     url: str
@@ -63,6 +113,127 @@ async def update_openai_key(form_data: KeyUpdateForm, user=Depends(get_admin_use
     return {"OPENAI_API_KEY": app.state.OPENAI_API_KEY}
 
 
+# Not forwarded: aiohttp decodes transfer/content encodings
+EXCLUDED_HEADERS = [
+    "content-length",
+    "transfer-encoding",
+    "content-encoding",
+    "connection",
+]
+
+
+async def open_upstream(
+    method: str,
+    url: str,
+    body: Optional[bytes] = None,
+    model: Optional[str] = None,
+    tokens: int = 0,
+) -> aiohttp.ClientResponse:
+    api_key = app.state.OPENAI_API_KEY
+    headers = {}
+    headers["Authorization"] = f"Bearer {api_key}"
+    headers["Content-Type"] = "application/json"
+
+    # Wait for room under the upstream's rate limits instead of running into them
+    if model:
+        try:
+            await RATE_LIMITER.acquire(api_key, model, tokens)
+        except RateLimitError as e:
+            raise HTTPException(
+                status_code=429,
+                detail=ERROR_MESSAGES.RATE_LIMIT_EXCEEDED,
+                headers={"Retry-After": str(e.retry_after)},
+            )
+
+    r = None
+    try:
+        session = await get_session()
+
+        attempt = 0
+        while True:
+            r = await session.request(
+                method=method, url=url, data=body, headers=headers
+            )
+            if model:
+                RATE_LIMITER.update(api_key, model, r.headers)
+
+            if r.status not in RETRY_STATUSES:
+                break
+            delay = RATE_LIMITER.get_retry_delay(attempt, r.headers)
+            if delay is None:
+                break
+
+            r.release()
+            attempt += 1
+            await asyncio.sleep(delay)
+
+        if r.status >= 400:
+            error_detail = f"External: {r.reason}"
+            try:
+                res = await r.json(content_type=None)
+                if "error" in res:
+                    error_detail = f"External: {res['error']}"
+            except:
+                pass
+            finally:
+                r.release()
+
+            raise HTTPException(status_code=r.status, detail=error_detail)
+        return r
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        print(e)
+        if r is not None:
+            r.close()
+        raise HTTPException(
+            status_code=500,
+            detail="Open WebUI: Server Connection Error",
+        )
+
+
+async def stream_content(r: aiohttp.ClientResponse, chunks):
+    try:
+        async for chunk in chunks:
+            yield chunk
+    except aiohttp.ClientError as e:
+        print(e)
+    finally:
+        r.close()
+
+
+@app.get("/metrics")
+async def get_metrics(user=Depends(get_admin_user)):
+    return {"rate_limits": RATE_LIMITER.to_dict()}
+
+
+def estimate_tokens(body: bytes, payload: dict) -> int:
+    # What the upstream counts against the limit: prompt plus the completion allowance
+    max_tokens = payload.get("max_tokens")
+    return len(body) // 4 + (max_tokens if isinstance(max_tokens, int) else 0)
+
+
+def is_listed_model(model: dict) -> bool:
+    # api.openai.com lists every model, only the chat models are offered
+    if "api.openai.com" in app.state.OPENAI_API_BASE_URL:
+        return "gpt" in model["id"]
+    return True
+
+
+async def get_models() -> Optional[list]:
+    if app.state.OPENAI_API_KEY == "":
+        return None
+
+    r = await open_upstream("GET", f"{app.state.OPENAI_API_BASE_URL}/models")
+    try:
+        res = await r.json(content_type=None)
+    finally:
+        r.close()
+
+    models = res if isinstance(res, list) else res.get("data") or []
+    return list(filter(is_listed_model, models))
+
+
 @app.post("/audio/speech")
 async def speech(request: Request, user=Depends(get_verified_user)):
     target_url = f"{app.state.OPENAI_API_BASE_URL}/audio/speech"
@@ -83,56 +254,50 @@ async def speech(request: Request, user=Depends(get_verified_user)):
     if file_path.is_file():
         return FileResponse(file_path)
 
-    headers = {}
-    headers["Authorization"] = f"Bearer {app.state.OPENAI_API_KEY}"
-    headers["Content-Type"] = "application/json"
-
     try:
-        print("openai")
-        r = requests.post(
-            url=target_url,
-            data=body,
-            headers=headers,
-            stream=True,
-        )
+        model = json.loads(body).get("model")
+    except Exception:
+        model = None
 
-        r.raise_for_status()
+    r = await open_upstream("POST", target_url, body, model)
+    # Written under a temporary name, so a failed download is never served from cache
+    part_path = SPEECH_CACHE_DIR.joinpath(f"{name}.mp3.part")
 
+    try:
         # Save the streaming content to a file
-        with open(file_path, "wb") as f:
-            for chunk in r.iter_content(chunk_size=8192):
+        with open(part_path, "wb") as f:
+            async for chunk in r.content.iter_chunked(8192):
                 f.write(chunk)
+        part_path.replace(file_path)
 
         with open(file_body_path, "w") as f:
             json.dump(json.loads(body.decode("utf-8")), f)
 
         # Return the saved file
         return FileResponse(file_path)
-
     except Exception as e:
         print(e)
-        error_detail = "Open WebUI: Server Connection Error"
-        if r is not None:
-            try:
-                res = r.json()
-                if "error" in res:
-                    error_detail = f"External: {res['error']}"
-            except:
-                error_detail = f"External: {e}"
-
-        raise HTTPException(status_code=r.status_code, detail=error_detail)
+        part_path.unlink(missing_ok=True)
+        raise HTTPException(
+            status_code=500,
+            detail="Open WebUI: Server Connection Error",
+        )
+    finally:
+        r.close()
 
 
 @app.api_route("/{path:path}", methods=["GET", "POST", "PUT", "DELETE"])
 async def proxy(path: str, request: Request, user=Depends(get_verified_user)):
     target_url = f"{app.state.OPENAI_API_BASE_URL}/{path}"
-    print(target_url, app.state.OPENAI_API_KEY)
 
     if app.state.OPENAI_API_KEY == "":
         raise HTTPException(status_code=401, detail=ERROR_MESSAGES.API_KEY_NOT_FOUND)
 
     body = await request.body()
 
+    model = None
+    tokens = 0
+
     # TODO: Remove below after gpt-4-vision fix from Open AI
     # Try to decode the body of the request from bytes to a UTF-8 string (Require add max_token to fix gpt-4-vision)
     try:
@@ -153,59 +318,51 @@ async def proxy(path: str, request: Request, user=Depends(get_verified_user)):
             # OpenAI API (Feb 2024)
             del body["num_ctx"]
 
+        if isinstance(body.get("model"), str):
+            model = body["model"]
+
         # Convert the modified body back to JSON
+        payload = body
         body = json.dumps(body)
+        tokens = estimate_tokens(body.encode("utf-8"), payload)
     except json.JSONDecodeError as e:
         print("Error loading request body into a dictionary:", e)
 
-    headers = {}
-    headers["Authorization"] = f"Bearer {app.state.OPENAI_API_KEY}"
-    headers["Content-Type"] = "application/json"
+    r = await open_upstream(request.method, target_url, body, model, tokens)
 
-    try:
-        r = requests.request(
-            method=request.method,
-            url=target_url,
-            data=body,
+    headers = {
+        key: value
+        for key, value in r.headers.items()
+        if key.lower() not in EXCLUDED_HEADERS
+    }
+
+    # Check if response is SSE
+    if r.content_type == "text/event-stream":
+        # Forward whole lines as they arrive, never a partial event line
+        return StreamingResponse(
+            stream_content(r, align_lines(r.content.iter_any())),
+            status_code=r.status,
             headers=headers,
-            stream=True,
         )
 
-        r.raise_for_status()
-
-        # Check if response is SSE
-        if "text/event-stream" in r.headers.get("Content-Type", ""):
-            return StreamingResponse(
-                r.iter_content(chunk_size=8192),
-                status_code=r.status_code,
-                headers=dict(r.headers),
+    if "api.openai.com" in app.state.OPENAI_API_BASE_URL and path == "models":
+        try:
+            response_data = await r.json(content_type=None)
+        except Exception as e:
+            print(e)
+            raise HTTPException(
+                status_code=500,
+                detail="Open WebUI: Server Connection Error",
             )
-        else:
-            # For non-SSE, read the response and return it
-            # response_data = (
-            #     r.json()
-            #     if r.headers.get("Content-Type", "")
-            #     == "application/json"
-            #     else r.text
-            # )
-
-            response_data = r.json()
-
-            if "api.openai.com" in app.state.OPENAI_API_BASE_URL and path == "models":
-                response_data["data"] = list(
-                    filter(lambda model: "gpt" in model["id"], response_data["data"])
-                )
-
-            return response_data
-    except Exception as e:
-        print(e)
-        error_detail = "Open WebUI: Server Connection Error"
-        if r is not None:
-            try:
-                res = r.json()
-                if "error" in res:
-                    error_detail = f"External: {res['error']}"
-            except:
-                error_detail = f"External: {e}"
-
-        raise HTTPException(status_code=r.status_code, detail=error_detail)
+        finally:
+            r.close()
+
+        response_data["data"] = list(filter(is_listed_model, response_data["data"]))
+        return response_data
+
+    # Anything else is passed through as it arrives instead of being parsed here
+    return StreamingResponse(
+        stream_content(r, r.content.iter_chunked(64 * 1024)),
+        status_code=r.status,
+        headers=headers,
+    )
@@ -0,0 +1,206 @@
+from typing import Dict, Optional, Tuple
+import asyncio
+import hashlib
+import math
+import random
+import re
+import time
+
+from utils.histogram import SECONDS_BUCKETS, Histogram
+
+
+# Statuses worth retrying after a short wait
+RETRY_STATUSES = [429, 503]
+
+# OpenAI limits are per minute
+WINDOW = 60
+
+
+class RateLimitError(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__(f"Rate limited, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    # Reset headers look like "1s", "6m0s", "20ms" or "1h2m3.5s"
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+
+    parts = re.findall(r"(\d+(?:\.\d+)?)(ms|h|m|s)", value)
+    if not parts:
+        return None
+    units = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    return sum(float(amount) * units[unit] for amount, unit in parts)
+
+
+def parse_int(value: Optional[str]) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """Refills to ``capacity`` over one window.
+
+    Reservations may take the bucket below zero; how far below is how long
+    the caller has to wait, so callers are served in arrival order.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+
+    @property
+    def rate(self) -> float:
+        return self.capacity / WINDOW
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated_at) * self.rate
+        )
+        self.updated_at = now
+
+    def reserve(self, amount: float) -> float:
+        """Take ``amount`` and return the seconds to wait before using it."""
+        self.refill()
+        self.tokens -= min(amount, self.capacity)
+        return max(0.0, -self.tokens / self.rate)
+
+    def refund(self, amount: float):
+        self.tokens += min(amount, self.capacity)
+
+    def update(self, limit: Optional[int], remaining: Optional[int]):
+        if limit:
+            self.capacity = limit
+        self.refill()
+        # The upstream also counts requests made with this key elsewhere
+        if remaining is not None:
+            self.tokens = min(self.tokens, remaining)
+
+
+class RateLimiter:
+    """Schedules requests to OpenAI-compatible upstreams within their limits.
+
+    Request and token buckets are kept per API key and model, sized from the
+    x-ratelimit-* headers of previous responses. Requests that would exceed
+    them wait their turn, unless the wait is longer than ``max_wait``.
+    """
+
+    def __init__(
+        self,
+        max_wait: float = 30,
+        max_retries: int = 3,
+        max_retry_delay: float = 20,
+        retry_base_delay: float = 0.5,
+    ):
+        self.max_wait = max_wait
+        self.max_retries = max_retries
+        self.max_retry_delay = max_retry_delay
+        self.retry_base_delay = retry_base_delay
+        self.buckets: Dict[Tuple[str, str], Dict[str, TokenBucket]] = {}
+
+        self.requests = 0
+        self.queued = 0
+        self.rejected = 0
+        self.retries = 0
+        self.queue_time = Histogram(SECONDS_BUCKETS)
+
+    @staticmethod
+    def get_key(api_key: str) -> str:
+        # Never keep or report the key itself
+        return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12]
+
+    async def acquire(self, api_key: str, model: str, tokens: int):
+        self.requests += 1
+        buckets = self.buckets.get((self.get_key(api_key), model), {})
+
+        reserved = {"requests": 1, "tokens": tokens}
+        wait = 0.0
+        for name, bucket in buckets.items():
+            wait = max(wait, bucket.reserve(reserved[name]))
+
+        if wait > self.max_wait:
+            for name, bucket in buckets.items():
+                bucket.refund(reserved[name])
+            self.rejected += 1
+            raise RateLimitError(math.ceil(wait))
+
+        if wait > 0:
+            self.queued += 1
+            await asyncio.sleep(wait)
+        self.queue_time.observe(wait)
+
+    def update(self, api_key: str, model: str, headers):
+        key = (self.get_key(api_key), model)
+        buckets = self.buckets.get(key, {})
+
+        for name in ["requests", "tokens"]:
+            limit = parse_int(headers.get(f"x-ratelimit-limit-{name}"))
+            remaining = parse_int(headers.get(f"x-ratelimit-remaining-{name}"))
+            if name not in buckets:
+                if not limit:
+                    continue
+                buckets[name] = TokenBucket(limit)
+            buckets[name].update(limit, remaining)
+
+        if buckets:
+            self.buckets[key] = buckets
+
+    def get_retry_delay(self, attempt: int, headers) -> Optional[float]:
+        """Seconds to wait before retrying a 429/503, or None to give up."""
+        if attempt >= self.max_retries:
+            return None
+
+        delays = [
+            parse_duration(headers.get(name))
+            for name in [
+                "retry-after",
+                "x-ratelimit-reset-requests",
+                "x-ratelimit-reset-tokens",
+            ]
+        ]
+        delays = [delay for delay in delays if delay]
+        delay = min(delays) if delays else self.retry_base_delay * 2**attempt
+
+        # Jitter, so queued requests do not all come back at the same moment
+        delay += random.uniform(0, delay / 2)
+        if delay > self.max_retry_delay:
+            return None
+
+        self.retries += 1
+        return delay
+
+    def to_dict(self) -> dict:
+        for buckets in self.buckets.values():
+            for bucket in buckets.values():
+                bucket.refill()
+
+        return {
+            "requests": self.requests,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "retries": self.retries,
+            "queue_time": self.queue_time.to_dict(),
+            "buckets": [
+                {
+                    "key": key,
+                    "model": model,
+                    **{
+                        name: {
+                            "capacity": bucket.capacity,
+                            "available": round(bucket.tokens, 2),
+                        }
+                        for name, bucket in buckets.items()
+                    },
+                }
+                for (key, model), buckets in self.buckets.items()
+            ],
+        }
@@ -0,0 +1,223 @@
+from pathlib import Path
+import json
+import os
+import re
+import shutil
+import sqlite3
+import time
+
+from apps.web.models.documents import Documents
+from apps.web.models.chats import Chats
+
+from apps.rag.utils import (
+    get_parsed_cache_entries,
+    get_parsed_cache_path,
+    load_parsed_docs,
+)
+from utils.misc import calculate_sha256
+
+from config import CHROMA_CLIENT, CHROMA_DATA_PATH, UPLOAD_DIR, RAG_PARSED_CACHE_DIR
+
+
+UUID_PATTERN = re.compile(
+    r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$"
+)
+
+
+# Collection metadata key holding when it was last created or stored into
+TOUCHED_AT_KEY = "touched_at"
+
+
+def touch_collection(collection):
+    metadata = {
+        key: value
+        for key, value in (collection.metadata or {}).items()
+        # Chroma refuses to change the distance function of an existing collection
+        if not key.startswith("hnsw:")
+    }
+    collection.modify(metadata={**metadata, TOUCHED_AT_KEY: int(time.time())})
+
+
+def get_touched_at(collection):
+    return (collection.metadata or {}).get(TOUCHED_AT_KEY)
+
+
+def get_dir_size(path: str) -> int:
+    total = 0
+    for file_path in Path(path).rglob("*"):
+        try:
+            if file_path.is_file():
+                total += file_path.stat().st_size
+        except OSError:
+            pass
+    return total
+
+
+def find_collection_names(value, collection_names: set):
+    # Chats store attached docs as {"collection_name": ...} or {"collection_names": [...]}
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if key == "collection_name" and isinstance(item, str):
+                collection_names.add(item)
+            elif key == "collection_names" and isinstance(item, list):
+                collection_names.update(name for name in item if isinstance(name, str))
+            else:
+                find_collection_names(item, collection_names)
+    elif isinstance(value, list):
+        for item in value:
+            find_collection_names(item, collection_names)
+
+
+def get_reachable_collection_names() -> set:
+    collection_names = set(doc.collection_name for doc in Documents.get_docs())
+
+    for chat in Chats.get_all_chats():
+        try:
+            find_collection_names(json.loads(chat.chat), collection_names)
+        except Exception as e:
+            print(e)
+
+    return collection_names
+
+
+def remove_orphan_segments(cutoff: float) -> int:
+    # Remove HNSW segment dirs left behind by deleted collections. Dirs modified
+    # after the cutoff are left alone, as their segment may have been created
+    # after the segments were listed.
+    db_path = f"{CHROMA_DATA_PATH}/chroma.sqlite3"
+    if not os.path.isfile(db_path):
+        return 0
+
+    # Read only; VACUUM would rewrite the file under the live PersistentClient
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, timeout=30)
+    try:
+        segment_ids = set(row[0] for row in conn.execute("SELECT id FROM segments"))
+    finally:
+        conn.close()
+
+    removed = 0
+    for path in Path(CHROMA_DATA_PATH).iterdir():
+        if not path.is_dir() or not UUID_PATTERN.match(path.name):
+            continue
+        if path.name in segment_ids or path.stat().st_mtime > cutoff:
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        removed += 1
+
+    return removed
+
+
+def collect_garbage(minhash_index=None, min_age: int = 3600, dry_run: bool = False):
+    """Delete vector collections, uploads and parsed-text cache entries that
+    are no longer referenced by any document or chat.
+
+    Collections stored into within the last ``min_age`` seconds are kept, so
+    files and web pages that have not been attached to a document or a sent
+    chat yet survive. A collection without a timestamp (created before they
+    were recorded) is stamped on its first run and only collected on a later
+    one. Uploads and cache entries are kept while any of their collections is.
+    """
+    start_time = time.time()
+    sizes_before = {
+        "vector_db": get_dir_size(CHROMA_DATA_PATH),
+        "uploads": get_dir_size(UPLOAD_DIR),
+        "cache": get_dir_size(RAG_PARSED_CACHE_DIR),
+    }
+
+    reachable = get_reachable_collection_names()
+    cutoff = time.time() - min_age
+
+    # Collections whose parsed text was cached recently are still being set up
+    recent = set()
+    cache_entries = {}
+    for sha256 in get_parsed_cache_entries():
+        entry = load_parsed_docs(sha256)
+        if entry == None:
+            continue
+        cache_entries[sha256] = entry
+        if get_parsed_cache_path(sha256).stat().st_mtime > cutoff:
+            recent.update(entry["collection_names"])
+
+    deleted_collections = []
+    for collection in CHROMA_CLIENT.list_collections():
+        if collection.name in reachable or collection.name in recent:
+            continue
+
+        touched_at = get_touched_at(collection)
+        if touched_at == None and not dry_run:
+            try:
+                touch_collection(collection)
+            except Exception as e:
+                print(e)
+        if touched_at == None or touched_at > cutoff:
+            recent.add(collection.name)
+            continue
+
+        if not dry_run:
+            try:
+                CHROMA_CLIENT.delete_collection(name=collection.name)
+            except Exception as e:
+                print(e)
+                continue
+            if minhash_index:
+                minhash_index.remove(collection.name)
+        deleted_collections.append(collection.name)
+
+    deleted_cache_entries = []
+    for sha256, entry in cache_entries.items():
+        if set(entry["collection_names"]) & (reachable | recent):
+            continue
+        if not dry_run:
+            os.unlink(get_parsed_cache_path(sha256))
+        deleted_cache_entries.append(sha256)
+
+    # Only RAG uploads are collected; other files in UPLOAD_DIR (model blobs) are left alone
+    rag_shas = set(cache_entries.keys())
+    rag_filenames = set(entry["filename"] for entry in cache_entries.values())
+    reachable_filenames = set(doc.filename for doc in Documents.get_docs())
+
+    deleted_uploads = []
+    for file_path in Path(UPLOAD_DIR).iterdir():
+        if not file_path.is_file() or file_path.stat().st_mtime > cutoff:
+            continue
+        if file_path.name in reachable_filenames:
+            continue
+        if file_path.name not in rag_filenames:
+            continue
+
+        with open(file_path, "rb") as f:
+            sha256 = calculate_sha256(f)
+
+        if sha256 in rag_shas and not (
+            set(cache_entries[sha256]["collection_names"]) & (reachable | recent)
+        ):
+            if not dry_run:
+                os.unlink(file_path)
+            deleted_uploads.append(file_path.name)
+
+    removed_segments = 0
+    if not dry_run:
+        if minhash_index:
+            minhash_index.save()
+        try:
+            removed_segments = remove_orphan_segments(cutoff)
+        except Exception as e:
+            print(e)
+
+    sizes_after = {
+        "vector_db": get_dir_size(CHROMA_DATA_PATH),
+        "uploads": get_dir_size(UPLOAD_DIR),
+        "cache": get_dir_size(RAG_PARSED_CACHE_DIR),
+    }
+
+    return {
+        "dry_run": dry_run,
+        "collections": deleted_collections,
+        "uploads": deleted_uploads,
+        "cache_entries": deleted_cache_entries,
+        "segments": removed_segments,
+        "reclaimed_bytes": {
+            key: sizes_before[key] - sizes_after[key] for key in sizes_before
+        },
+        "duration": round(time.time() - start_time, 3),
+    }
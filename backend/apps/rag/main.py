@@ -34,6 +34,7 @@ from langchain.text_splitter import RecursiveCharacterTextSplitter
 from pydantic import BaseModel
 from typing import Optional
 import mimetypes
+import time
 import uuid
 import json
 
@@ -44,6 +45,18 @@ from apps.web.models.documents import (
     DocumentResponse,
 )
 
+from apps.rag.cleanup import TOUCHED_AT_KEY, collect_garbage, touch_collection
+from apps.rag.minhash import MinHashIndex
+from apps.rag.splitter import TokenTextSplitter, get_embedding_tokenizer
+from apps.rag.utils import (
+    query_embeddings_doc,
+    query_embeddings_collection,
+    load_parsed_docs,
+    save_parsed_docs,
+    get_parsed_cache_entries,
+    get_parsed_cache_path,
+)
+
 from utils.misc import (
     calculate_sha256,
     calculate_sha256_string,
@@ -59,7 +72,13 @@ from config import (
     CHROMA_CLIENT,
     CHUNK_SIZE,
     CHUNK_OVERLAP,
+    RAG_TEXT_SPLITTER,
     RAG_TEMPLATE,
+    RAG_DEDUP_MODE,
+    RAG_DEDUP_THRESHOLD,
+    RAG_MINHASH_INDEX_PATH,
+    RAG_GC_INTERVAL,
+    RAG_GC_MIN_AGE,
 )
 
 from constants import ERROR_MESSAGES
@@ -80,6 +99,13 @@ app.state.CHUNK_OVERLAP = CHUNK_OVERLAP
 app.state.RAG_TEMPLATE = RAG_TEMPLATE
 app.state.RAG_EMBEDDING_MODEL = RAG_EMBEDDING_MODEL
 app.state.TOP_K = 4
+app.state.TEXT_SPLITTER = RAG_TEXT_SPLITTER
+app.state.text_splitter = None
+app.state.tokenizer = None
+
+app.state.DEDUP_MODE = RAG_DEDUP_MODE
+app.state.DEDUP_THRESHOLD = RAG_DEDUP_THRESHOLD
+app.state.minhash_index = MinHashIndex(RAG_MINHASH_INDEX_PATH)
 
 app.state.sentence_transformer_ef = (
     embedding_functions.SentenceTransformerEmbeddingFunction(
@@ -100,6 +126,18 @@ app.add_middleware(
 )
 
 
+EMBEDDING_BATCH_SIZE = 64
+
+
+def add_docs_to_collection(collection, docs):
+    texts = [doc.page_content for doc in docs]
+    metadatas = [doc.metadata for doc in docs]
+
+    collection.add(
+        documents=texts, metadatas=metadatas, ids=[str(uuid.uuid1()) for _ in texts]
+    )
+
+
 class CollectionNameForm(BaseModel):
     collection_name: Optional[str] = "test"
 
@@ -108,28 +146,56 @@ class StoreWebForm(CollectionNameForm):
     url: str
 
 
-def store_data_in_vector_db(data, collection_name) -> bool:
-    text_splitter = RecursiveCharacterTextSplitter(
+def get_text_splitter():
+    if app.state.TEXT_SPLITTER == "token":
+        if app.state.tokenizer == None:
+            app.state.tokenizer = get_embedding_tokenizer(app.state.RAG_EMBEDDING_MODEL)
+
+        # sentence-transformers truncates at max_seq_length, which can be shorter than the tokenizer limit
+        model = getattr(app.state.sentence_transformer_ef, "_model", None)
+
+        return TokenTextSplitter(
+            tokenizer=app.state.tokenizer,
+            chunk_size=app.state.CHUNK_SIZE,
+            chunk_overlap=app.state.CHUNK_OVERLAP,
+            max_length=getattr(model, "max_seq_length", None),
+        )
+
+    return RecursiveCharacterTextSplitter(
         chunk_size=app.state.CHUNK_SIZE, chunk_overlap=app.state.CHUNK_OVERLAP
     )
-    docs = text_splitter.split_documents(data)
 
-    texts = [doc.page_content for doc in docs]
-    metadatas = [doc.metadata for doc in docs]
+
+def store_data_in_vector_db(data, collection_name) -> bool:
+    if app.state.text_splitter == None:
+        app.state.text_splitter = get_text_splitter()
 
     try:
         collection = CHROMA_CLIENT.create_collection(
             name=collection_name,
             embedding_function=app.state.sentence_transformer_ef,
+            metadata={TOUCHED_AT_KEY: int(time.time())},
         )
 
-        collection.add(
-            documents=texts, metadatas=metadatas, ids=[str(uuid.uuid1()) for _ in texts]
-        )
+        # Embed in fixed-size batches so memory stays flat for large documents
+        batch = []
+        for doc in app.state.text_splitter.split_documents(data):
+            batch.append(doc)
+            if len(batch) >= EMBEDDING_BATCH_SIZE:
+                add_docs_to_collection(collection, batch)
+                batch = []
+
+        if batch:
+            add_docs_to_collection(collection, batch)
         return True
     except Exception as e:
         print(e)
         if e.__class__.__name__ == "UniqueConstraintError":
+            # Re-added to a chat, so keep it from the garbage collector for a while
+            try:
+                touch_collection(CHROMA_CLIENT.get_collection(name=collection_name))
+            except Exception as e:
+                print(e)
             return True
 
         return False
@@ -169,6 +235,8 @@ async def update_embedding_model(
             device=RAG_EMBEDDING_MODEL_DEVICE_TYPE,
         )
     )
+    app.state.tokenizer = None
+    app.state.text_splitter = None
 
     return {
         "status": True,
@@ -182,12 +250,14 @@ async def get_chunk_params(user=Depends(get_admin_user)):
         "status": True,
         "chunk_size": app.state.CHUNK_SIZE,
         "chunk_overlap": app.state.CHUNK_OVERLAP,
+        "text_splitter": app.state.TEXT_SPLITTER,
     }
 
 
 class ChunkParamUpdateForm(BaseModel):
     chunk_size: int
     chunk_overlap: int
+    text_splitter: Optional[str] = None
 
 
 @app.post("/chunk/update")
@@ -196,11 +266,15 @@ async def update_chunk_params(
 ):
     app.state.CHUNK_SIZE = form_data.chunk_size
     app.state.CHUNK_OVERLAP = form_data.chunk_overlap
+    if form_data.text_splitter in ["character", "token"]:
+        app.state.TEXT_SPLITTER = form_data.text_splitter
+    app.state.text_splitter = None
 
     return {
         "status": True,
         "chunk_size": app.state.CHUNK_SIZE,
         "chunk_overlap": app.state.CHUNK_OVERLAP,
+        "text_splitter": app.state.TEXT_SPLITTER,
     }
 
 
@@ -247,16 +321,12 @@ def query_doc(
     user=Depends(get_current_user),
 ):
     try:
-        # if you use docker use the model from the environment variable
-        collection = CHROMA_CLIENT.get_collection(
-            name=form_data.collection_name,
+        return query_embeddings_doc(
+            collection_name=form_data.collection_name,
+            query=form_data.query,
+            k=form_data.k if form_data.k else app.state.TOP_K,
             embedding_function=app.state.sentence_transformer_ef,
         )
-        result = collection.query(
-            query_texts=[form_data.query],
-            n_results=form_data.k if form_data.k else app.state.TOP_K,
-        )
-        return result
     except Exception as e:
         print(e)
         raise HTTPException(
@@ -271,76 +341,16 @@ class QueryCollectionsForm(BaseModel):
     k: Optional[int] = None
 
 
-def merge_and_sort_query_results(query_results, k):
-    # Initialize lists to store combined data
-    combined_ids = []
-    combined_distances = []
-    combined_metadatas = []
-    combined_documents = []
-
-    # Combine data from each dictionary
-    for data in query_results:
-        combined_ids.extend(data["ids"][0])
-        combined_distances.extend(data["distances"][0])
-        combined_metadatas.extend(data["metadatas"][0])
-        combined_documents.extend(data["documents"][0])
-
-    # Create a list of tuples (distance, id, metadata, document)
-    combined = list(
-        zip(combined_distances, combined_ids, combined_metadatas, combined_documents)
-    )
-
-    # Sort the list based on distances
-    combined.sort(key=lambda x: x[0])
-
-    # Unzip the sorted list
-    sorted_distances, sorted_ids, sorted_metadatas, sorted_documents = zip(*combined)
-
-    # Slicing the lists to include only k elements
-    sorted_distances = list(sorted_distances)[:k]
-    sorted_ids = list(sorted_ids)[:k]
-    sorted_metadatas = list(sorted_metadatas)[:k]
-    sorted_documents = list(sorted_documents)[:k]
-
-    # Create the output dictionary
-    merged_query_results = {
-        "ids": [sorted_ids],
-        "distances": [sorted_distances],
-        "metadatas": [sorted_metadatas],
-        "documents": [sorted_documents],
-        "embeddings": None,
-        "uris": None,
-        "data": None,
-    }
-
-    return merged_query_results
-
-
 @app.post("/query/collection")
 def query_collection(
     form_data: QueryCollectionsForm,
     user=Depends(get_current_user),
 ):
-    results = []
-
-    for collection_name in form_data.collection_names:
-        try:
-            # if you use docker use the model from the environment variable
-            collection = CHROMA_CLIENT.get_collection(
-                name=collection_name,
-                embedding_function=app.state.sentence_transformer_ef,
-            )
-
-            result = collection.query(
-                query_texts=[form_data.query],
-                n_results=form_data.k if form_data.k else app.state.TOP_K,
-            )
-            results.append(result)
-        except:
-            pass
-
-    return merge_and_sort_query_results(
-        results, form_data.k if form_data.k else app.state.TOP_K
+    return query_embeddings_collection(
+        collection_names=form_data.collection_names,
+        query=form_data.query,
+        k=form_data.k if form_data.k else app.state.TOP_K,
+        embedding_function=app.state.sentence_transformer_ef,
     )
 
 
@@ -457,6 +467,68 @@ def get_loader(filename: str, file_content_type: str, file_path: str):
     # HOTFIX: END CODE INJECTION
 
 
+def load_file_docs(
+    sha256: str,
+    filename: str,
+    file_content_type: str,
+    file_path: str,
+):
+    loader, known_type = get_loader(filename, file_content_type, file_path)
+
+    # Reuse previously extracted text so identical files are never parsed twice
+    entry = load_parsed_docs(sha256)
+    if entry:
+        return entry["docs"], known_type, entry["collection_names"]
+
+    # The collection is only recorded once the document is stored, so /reindex
+    # never embeds a near-duplicate that was skipped
+    data = loader.load()
+    save_parsed_docs(sha256, data, None, filename)
+    return data, known_type, []
+
+
+def find_near_duplicate(data, collection_name: str):
+    if app.state.DEDUP_MODE == "off":
+        return None, None
+
+    text = " ".join(doc.page_content for doc in data)
+    signature = app.state.minhash_index.get_signature(text)
+    duplicate = app.state.minhash_index.query(signature, exclude=collection_name)
+
+    if duplicate and duplicate[1] >= app.state.DEDUP_THRESHOLD:
+        return duplicate, signature
+    return None, signature
+
+
+def record_near_duplicate(
+    duplicate, collection_name: str, filename: str, skipped: bool
+):
+    original_collection_name, similarity = duplicate
+
+    doc = Documents.get_doc_by_collection_name(original_collection_name)
+    if doc:
+        content = json.loads(doc.content if doc.content else "{}")
+        near_duplicates = content.get("near_duplicates", [])
+
+        # Rescans find the same pairs again
+        for item in near_duplicates:
+            if item.get("filename") == filename or (
+                not skipped and item.get("collection_name") == collection_name
+            ):
+                return
+
+        near_duplicates.append(
+            {
+                "collection_name": None if skipped else collection_name,
+                "filename": filename,
+                "similarity": similarity,
+            }
+        )
+        Documents.update_doc_content_by_name(
+            doc.name, {"near_duplicates": near_duplicates}
+        )
+
+
 @app.post("/doc")
 def store_doc(
     collection_name: Optional[str] = Form(None),
@@ -475,20 +547,50 @@ def store_doc(
             f.close()
 
         f = open(file_path, "rb")
+        sha256 = calculate_sha256(f)
         if collection_name == None:
-            collection_name = calculate_sha256(f)[:63]
+            collection_name = sha256[:63]
         f.close()
 
-        loader, known_type = get_loader(file.filename, file.content_type, file_path)
-        data = loader.load()
+        data, known_type, cached_collection_names = load_file_docs(
+            sha256, filename, file.content_type, file_path
+        )
+
+        duplicate, signature = find_near_duplicate(data, collection_name)
+        if duplicate:
+            record_near_duplicate(
+                duplicate, collection_name, filename, app.state.DEDUP_MODE == "skip"
+            )
+
+            if app.state.DEDUP_MODE == "skip":
+                return {
+                    "status": True,
+                    "collection_name": duplicate[0],
+                    "filename": filename,
+                    "known_type": known_type,
+                    "duplicate_of": duplicate[0],
+                    "similarity": duplicate[1],
+                }
+
+        if collection_name not in cached_collection_names:
+            save_parsed_docs(sha256, data, collection_name, filename)
         result = store_data_in_vector_db(data, collection_name)
 
         if result:
+            if signature is not None:
+                app.state.minhash_index.insert(collection_name, signature)
+                app.state.minhash_index.save()
+
             return {
                 "status": True,
                 "collection_name": collection_name,
                 "filename": filename,
                 "known_type": known_type,
+                **(
+                    {"duplicate_of": duplicate[0], "similarity": duplicate[1]}
+                    if duplicate
+                    else {}
+                ),
             }
         else:
             raise HTTPException(
@@ -519,21 +621,50 @@ def scan_docs_dir(user=Depends(get_admin_user)):
                 file_content_type = mimetypes.guess_type(path)
 
                 f = open(path, "rb")
-                collection_name = calculate_sha256(f)[:63]
+                sha256 = calculate_sha256(f)
+                collection_name = sha256[:63]
                 f.close()
 
-                loader, known_type = get_loader(
-                    filename, file_content_type[0], str(path)
+                data, known_type, cached_collection_names = load_file_docs(
+                    sha256, filename, file_content_type[0], str(path)
                 )
-                data = loader.load()
 
+                duplicate, signature = find_near_duplicate(data, collection_name)
+                if duplicate:
+                    record_near_duplicate(
+                        duplicate,
+                        collection_name,
+                        filename,
+                        app.state.DEDUP_MODE == "skip",
+                    )
+
+                    if app.state.DEDUP_MODE == "skip":
+                        continue
+
+                if collection_name not in cached_collection_names:
+                    save_parsed_docs(sha256, data, collection_name, filename)
                 result = store_data_in_vector_db(data, collection_name)
 
                 if result:
+                    if signature is not None:
+                        app.state.minhash_index.insert(collection_name, signature)
+
                     sanitized_filename = sanitize_filename(filename)
                     doc = Documents.get_doc_by_name(sanitized_filename)
 
                     if doc == None:
+                        content = {}
+                        if len(tags):
+                            content["tags"] = list(
+                                map(
+                                    lambda name: {"name": name},
+                                    tags,
+                                )
+                            )
+                        if duplicate:
+                            content["duplicate_of"] = duplicate[0]
+                            content["similarity"] = duplicate[1]
+
                         doc = Documents.insert_new_doc(
                             user.id,
                             DocumentForm(
@@ -542,20 +673,7 @@ def scan_docs_dir(user=Depends(get_admin_user)):
                                     "title": filename,
                                     "collection_name": collection_name,
                                     "filename": filename,
-                                    "content": (
-                                        json.dumps(
-                                            {
-                                                "tags": list(
-                                                    map(
-                                                        lambda name: {"name": name},
-                                                        tags,
-                                                    )
-                                                )
-                                            }
-                                        )
-                                        if len(tags)
-                                        else "{}"
-                                    ),
+                                    "content": json.dumps(content),
                                 }
                             ),
                         )
@@ -563,12 +681,81 @@ def scan_docs_dir(user=Depends(get_admin_user)):
         except Exception as e:
             print(e)
 
+    app.state.minhash_index.save()
     return True
 
 
+@app.post("/reindex")
+def reindex_docs(user=Depends(get_admin_user)):
+    # Rebuild every cached collection with the current chunk params and embedding model
+    collection_names = []
+
+    for sha256 in get_parsed_cache_entries():
+        entry = load_parsed_docs(sha256)
+        if entry == None:
+            continue
+
+        for collection_name in entry["collection_names"]:
+            try:
+                CHROMA_CLIENT.delete_collection(name=collection_name)
+            except Exception as e:
+                print(e)
+
+            if store_data_in_vector_db(entry["docs"], collection_name):
+                collection_names.append(collection_name)
+
+    return {
+        "status": True,
+        "chunk_size": app.state.CHUNK_SIZE,
+        "chunk_overlap": app.state.CHUNK_OVERLAP,
+        "embedding_model": app.state.RAG_EMBEDDING_MODEL,
+        "collection_names": collection_names,
+    }
+
+
+class GarbageCollectForm(BaseModel):
+    dry_run: Optional[bool] = False
+    min_age: Optional[int] = None
+
+
+@app.post("/gc")
+def collect_vector_db_garbage(
+    form_data: GarbageCollectForm, user=Depends(get_admin_user)
+):
+    return collect_garbage(
+        minhash_index=app.state.minhash_index,
+        min_age=form_data.min_age if form_data.min_age != None else RAG_GC_MIN_AGE,
+        dry_run=form_data.dry_run,
+    )
+
+
+def start_gc_scheduler():
+    if RAG_GC_INTERVAL <= 0:
+        return None
+
+    from apscheduler.schedulers.background import BackgroundScheduler
+
+    def run_gc():
+        try:
+            print(
+                "RAG GC:",
+                collect_garbage(
+                    minhash_index=app.state.minhash_index, min_age=RAG_GC_MIN_AGE
+                ),
+            )
+        except Exception as e:
+            print(e)
+
+    scheduler = BackgroundScheduler()
+    scheduler.add_job(run_gc, "interval", hours=RAG_GC_INTERVAL)
+    scheduler.start()
+    return scheduler
+
+
 @app.get("/reset/db")
 def reset_vector_db(user=Depends(get_admin_user)):
     CHROMA_CLIENT.reset()
+    app.state.minhash_index.clear()
 
 
 @app.get("/reset")
@@ -584,8 +771,15 @@ def reset(user=Depends(get_admin_user)) -> bool:
         except Exception as e:
             print("Failed to delete %s. Reason: %s" % (file_path, e))
 
+    for sha256 in get_parsed_cache_entries():
+        try:
+            os.unlink(get_parsed_cache_path(sha256))
+        except Exception as e:
+            print(e)
+
     try:
         CHROMA_CLIENT.reset()
+        app.state.minhash_index.clear()
     except Exception as e:
         print(e)
 
@@ -0,0 +1,151 @@
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import json
+import os
+import re
+import threading
+import zlib
+
+import numpy as np
+
+
+# (a * x + b) mod p over 32-bit shingle hashes, p being the Mersenne prime 2^61 - 1;
+# like datasketch, the product is allowed to wrap at 64 bits
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+
+
+class MinHashIndex:
+    """MinHash signatures per collection with an LSH band index on top.
+
+    Signatures are persisted as JSON so the index survives restarts; the
+    band buckets are cheap to rebuild and live only in memory.
+    """
+
+    def __init__(
+        self,
+        file_path: str,
+        num_perm: int = 128,
+        bands: int = 32,
+        shingle_size: int = 5,
+        seed: int = 1,
+    ):
+        self.file_path = Path(file_path)
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+
+        generator = np.random.RandomState(seed)
+        self.a = generator.randint(1, 1 << 32, size=num_perm, dtype=np.uint64)
+        self.b = generator.randint(0, 1 << 32, size=num_perm, dtype=np.uint64)
+
+        self.signatures: Dict[str, np.ndarray] = {}
+        self.buckets: Dict[Tuple[int, bytes], set] = {}
+        self.lock = threading.RLock()
+        self.load()
+
+    def load(self):
+        if not self.file_path.is_file():
+            return
+
+        try:
+            with open(self.file_path, "r") as f:
+                data = json.load(f)
+
+            for collection_name, signature in data.items():
+                self.insert(collection_name, np.array(signature, dtype=np.uint64))
+        except Exception as e:
+            print(e)
+
+    def save(self):
+        with self.lock:
+            tmp_path = self.file_path.with_suffix(".tmp")
+            with open(tmp_path, "w") as f:
+                json.dump(
+                    {
+                        collection_name: signature.tolist()
+                        for collection_name, signature in self.signatures.items()
+                    },
+                    f,
+                )
+            os.replace(tmp_path, self.file_path)
+
+    def get_shingles(self, text: str) -> np.ndarray:
+        words = re.findall(r"\w+", text.lower())
+        if len(words) < self.shingle_size:
+            words = words + [""] * (self.shingle_size - len(words))
+
+        return np.unique(
+            np.array(
+                [
+                    zlib.crc32(" ".join(words[i : i + self.shingle_size]).encode())
+                    for i in range(len(words) - self.shingle_size + 1)
+                ],
+                dtype=np.uint64,
+            )
+        )
+
+    def get_signature(self, text: str) -> np.ndarray:
+        shingles = self.get_shingles(text)
+        signature = np.full(self.num_perm, MAX_HASH, dtype=np.uint64)
+
+        # Hash in slices to bound the (num_perm, n) intermediate
+        for i in range(0, len(shingles), 4096):
+            block = shingles[i : i + 4096]
+            hashes = (np.outer(self.a, block) + self.b[:, None]) % MERSENNE_PRIME
+            signature = np.minimum(signature, (hashes & MAX_HASH).min(axis=1))
+
+        return signature
+
+    def get_band_keys(self, signature: np.ndarray) -> List[Tuple[int, bytes]]:
+        return [
+            (band, signature[band * self.rows : (band + 1) * self.rows].tobytes())
+            for band in range(self.bands)
+        ]
+
+    def insert(self, collection_name: str, signature: np.ndarray):
+        with self.lock:
+            self.remove(collection_name)
+            self.signatures[collection_name] = signature
+            for key in self.get_band_keys(signature):
+                self.buckets.setdefault(key, set()).add(collection_name)
+
+    def remove(self, collection_name: str):
+        with self.lock:
+            signature = self.signatures.pop(collection_name, None)
+            if signature is None:
+                return
+
+            for key in self.get_band_keys(signature):
+                bucket = self.buckets.get(key)
+                if bucket:
+                    bucket.discard(collection_name)
+                    if not bucket:
+                        del self.buckets[key]
+
+    def clear(self):
+        with self.lock:
+            self.signatures = {}
+            self.buckets = {}
+            self.save()
+
+    def query(
+        self, signature: np.ndarray, exclude: Optional[str] = None
+    ) -> Optional[Tuple[str, float]]:
+        # Best candidate sharing at least one band, with its estimated Jaccard similarity
+        with self.lock:
+            candidates = set()
+            for key in self.get_band_keys(signature):
+                candidates.update(self.buckets.get(key, ()))
+            candidates.discard(exclude)
+
+            candidates = [(name, self.signatures[name]) for name in candidates]
+
+        best = None
+        for collection_name, candidate in candidates:
+            similarity = float(np.mean(candidate == signature))
+            if best is None or similarity > best[1]:
+                best = (collection_name, similarity)
+
+        return best
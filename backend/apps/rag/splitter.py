@@ -0,0 +1,139 @@
+from typing import Iterable, Iterator, List, Optional
+
+from langchain_core.documents import Document
+
+
+def get_embedding_tokenizer(model_name: str):
+    from transformers import AutoTokenizer
+
+    # sentence-transformers accepts short names such as "all-MiniLM-L6-v2"
+    names = [model_name]
+    if "/" not in model_name:
+        names.append(f"sentence-transformers/{model_name}")
+
+    for name in names:
+        try:
+            return AutoTokenizer.from_pretrained(name, use_fast=True)
+        except Exception as e:
+            print(e)
+
+    raise ValueError(f"Could not load a tokenizer for {model_name}")
+
+
+class TokenTextSplitter:
+    """Splits documents into chunks measured in embedding-model tokens.
+
+    Pages are consumed lazily and chunks are yielded as soon as they are
+    complete, so the whole corpus never has to sit in memory at once.
+    """
+
+    def __init__(
+        self,
+        tokenizer,
+        chunk_size: int,
+        chunk_overlap: int,
+        max_length: Optional[int] = None,
+        batch_size: int = 64,
+        separators: Optional[List[str]] = None,
+    ):
+        # Chunks longer than the model's window would be silently truncated.
+        # Tokens are counted without the [CLS]/[SEP] the embedder adds.
+        if max_length is None:
+            max_length = getattr(tokenizer, "model_max_length", None)
+        if max_length:
+            max_length -= tokenizer.num_special_tokens_to_add()
+        else:
+            max_length = chunk_size
+        self.chunk_size = max(1, min(chunk_size, max_length))
+        self.chunk_overlap = min(chunk_overlap, self.chunk_size // 2)
+
+        self.tokenizer = tokenizer
+        self.batch_size = batch_size
+        self.separators = separators or ["\n\n", "\n", ". ", " "]
+
+    def count_tokens(self, texts: List[str]) -> List[int]:
+        lengths = []
+        for i in range(0, len(texts), self.batch_size):
+            encoded = self.tokenizer(
+                texts[i : i + self.batch_size], add_special_tokens=False
+            )
+            lengths.extend(len(ids) for ids in encoded["input_ids"])
+        return lengths
+
+    def split_pieces(self, text: str, separators: List[str]) -> List[str]:
+        # Break text on the coarsest separator, keeping the separator attached
+        if not separators:
+            return [text]
+
+        separator, rest = separators[0], separators[1:]
+        parts = text.split(separator)
+        pieces = [part + separator for part in parts[:-1]] + [parts[-1]]
+        pieces = [piece for piece in pieces if piece]
+
+        if len(pieces) <= 1:
+            return self.split_pieces(text, rest)
+        return pieces
+
+    def split_by_tokens(self, text: str) -> List[str]:
+        encoded = self.tokenizer(
+            text, add_special_tokens=False, return_offsets_mapping=True
+        )
+        offsets = encoded["offset_mapping"]
+
+        step = self.chunk_size - self.chunk_overlap
+        chunks = []
+        for start in range(0, len(offsets), step):
+            end = min(start + self.chunk_size, len(offsets)) - 1
+            chunks.append(text[offsets[start][0] : offsets[end][1]])
+            if end == len(offsets) - 1:
+                break
+        return chunks
+
+    def split_text(
+        self, text: str, separators: Optional[List[str]] = None
+    ) -> Iterator[str]:
+        separators = self.separators if separators is None else separators
+
+        pieces = self.split_pieces(text, separators)
+        lengths = self.count_tokens(pieces)
+
+        # (piece, token length) pairs making up the chunk being built
+        current = []
+        current_length = 0
+
+        for piece, length in zip(pieces, lengths):
+            if length > self.chunk_size:
+                if current:
+                    yield "".join(p for p, _ in current).strip()
+                    current, current_length = [], 0
+
+                if len(separators) > 1:
+                    yield from self.split_text(piece, separators[1:])
+                else:
+                    yield from self.split_by_tokens(piece)
+                continue
+
+            if current and current_length + length > self.chunk_size:
+                yield "".join(p for p, _ in current).strip()
+
+                # Carry the trailing pieces over as overlap for the next chunk
+                overlap, overlap_length = [], 0
+                for prev in reversed(current):
+                    if overlap_length + prev[1] > self.chunk_overlap:
+                        break
+                    overlap.insert(0, prev)
+                    overlap_length += prev[1]
+
+                current, current_length = overlap, overlap_length
+
+            current.append((piece, length))
+            current_length += length
+
+        if current:
+            yield "".join(p for p, _ in current).strip()
+
+    def split_documents(self, documents: Iterable[Document]) -> Iterator[Document]:
+        for document in documents:
+            for text in self.split_text(document.page_content):
+                if text:
+                    yield Document(page_content=text, metadata=dict(document.metadata))
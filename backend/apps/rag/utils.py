@@ -0,0 +1,163 @@
+from typing import List, Optional
+from pathlib import Path
+import gzip
+import json
+import os
+
+from langchain_core.documents import Document
+
+from config import CHROMA_CLIENT, RAG_PARSED_CACHE_DIR
+
+
+def query_embeddings_doc(collection_name: str, query: str, k: int, embedding_function):
+    # if you use docker use the model from the environment variable
+    collection = CHROMA_CLIENT.get_collection(
+        name=collection_name,
+        embedding_function=embedding_function,
+    )
+    result = collection.query(
+        query_texts=[query],
+        n_results=k,
+    )
+    return result
+
+
+def merge_and_sort_query_results(query_results, k):
+    # Initialize lists to store combined data
+    combined_ids = []
+    combined_distances = []
+    combined_metadatas = []
+    combined_documents = []
+
+    # Combine data from each dictionary
+    for data in query_results:
+        combined_ids.extend(data["ids"][0])
+        combined_distances.extend(data["distances"][0])
+        combined_metadatas.extend(data["metadatas"][0])
+        combined_documents.extend(data["documents"][0])
+
+    # Create a list of tuples (distance, id, metadata, document)
+    combined = list(
+        zip(combined_distances, combined_ids, combined_metadatas, combined_documents)
+    )
+
+    # Sort the list based on distances
+    combined.sort(key=lambda x: x[0])
+
+    # Unzip the sorted list
+    sorted_distances, sorted_ids, sorted_metadatas, sorted_documents = (
+        zip(*combined) if combined else ([], [], [], [])
+    )
+
+    # Slicing the lists to include only k elements
+    sorted_distances = list(sorted_distances)[:k]
+    sorted_ids = list(sorted_ids)[:k]
+    sorted_metadatas = list(sorted_metadatas)[:k]
+    sorted_documents = list(sorted_documents)[:k]
+
+    # Create the output dictionary
+    merged_query_results = {
+        "ids": [sorted_ids],
+        "distances": [sorted_distances],
+        "metadatas": [sorted_metadatas],
+        "documents": [sorted_documents],
+        "embeddings": None,
+        "uris": None,
+        "data": None,
+    }
+
+    return merged_query_results
+
+
+def query_embeddings_collection(
+    collection_names: List[str], query: str, k: int, embedding_function
+):
+    results = []
+
+    for collection_name in collection_names:
+        try:
+            result = query_embeddings_doc(
+                collection_name=collection_name,
+                query=query,
+                k=k,
+                embedding_function=embedding_function,
+            )
+            results.append(result)
+        except:
+            pass
+
+    return merge_and_sort_query_results(results, k)
+
+
+def rag_template(template: str, context: str, query: str):
+    template = template.replace("[context]", context)
+    template = template.replace("[query]", query)
+    return template
+
+
+####################################
+# Parsed text cache
+####################################
+
+
+def get_parsed_cache_path(sha256: str) -> Path:
+    return Path(RAG_PARSED_CACHE_DIR).joinpath(f"{sha256}.json.gz")
+
+
+def load_parsed_docs(sha256: str) -> Optional[dict]:
+    file_path = get_parsed_cache_path(sha256)
+    if not file_path.is_file():
+        return None
+
+    try:
+        with gzip.open(file_path, "rt", encoding="utf-8") as f:
+            entry = json.load(f)
+
+        entry["docs"] = [
+            Document(page_content=doc["page_content"], metadata=doc["metadata"])
+            for doc in entry["docs"]
+        ]
+        return entry
+    except Exception as e:
+        print(e)
+        return None
+
+
+def save_parsed_docs(
+    sha256: str, docs: List[Document], collection_name: Optional[str], filename: str
+) -> bool:
+    entry = load_parsed_docs(sha256)
+    collection_names = entry["collection_names"] if entry else []
+    if collection_name != None and collection_name not in collection_names:
+        collection_names.append(collection_name)
+
+    file_path = get_parsed_cache_path(sha256)
+    tmp_path = file_path.with_suffix(".tmp")
+
+    try:
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "sha256": sha256,
+                    "filename": filename,
+                    "collection_names": collection_names,
+                    "docs": [
+                        {"page_content": doc.page_content, "metadata": doc.metadata}
+                        for doc in docs
+                    ],
+                },
+                f,
+                default=str,
+            )
+        os.replace(tmp_path, file_path)
+        return True
+    except Exception as e:
+        print(e)
+        return False
+
+
+def get_parsed_cache_entries() -> List[str]:
+    return [
+        file_path.name[: -len(".json.gz")]
+        for file_path in Path(RAG_PARSED_CACHE_DIR).glob("*.json.gz")
+    ]
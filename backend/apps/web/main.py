@@ -33,6 +33,9 @@ app.state.DEFAULT_PROMPT_SUGGESTIONS = DEFAULT_PROMPT_SUGGESTIONS
 app.state.DEFAULT_USER_ROLE = DEFAULT_USER_ROLE
 app.state.USER_PERMISSIONS = USER_PERMISSIONS
 
+# Set by the main app to load a user's default model on sign-in
+app.state.PREWARM_MODEL = None
+
 
 app.add_middleware(
     CORSMiddleware,
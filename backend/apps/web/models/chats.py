@@ -145,6 +145,15 @@ class ChatTable:
             .order_by(Chat.timestamp.desc())
         ]
 
+    def get_latest_chat_by_user_id(self, user_id: str) -> Optional[ChatModel]:
+        chat = (
+            Chat.select()
+            .where(Chat.user_id == user_id)
+            .order_by(Chat.timestamp.desc())
+            .first()
+        )
+        return ChatModel(**model_to_dict(chat)) if chat else None
+
     def get_chat_by_id_and_user_id(self, id: str, user_id: str) -> Optional[ChatModel]:
         try:
             chat = Chat.get(Chat.id == id, Chat.user_id == user_id)
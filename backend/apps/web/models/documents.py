@@ -97,6 +97,15 @@ class DocumentsTable:
         except:
             return None
 
+    def get_doc_by_collection_name(
+        self, collection_name: str
+    ) -> Optional[DocumentModel]:
+        try:
+            document = Document.get(Document.collection_name == collection_name)
+            return DocumentModel(**model_to_dict(document))
+        except:
+            return None
+
     def get_docs(self) -> List[DocumentModel]:
         return [
             DocumentModel(**model_to_dict(doc))
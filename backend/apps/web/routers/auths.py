@@ -1,13 +1,14 @@
 from fastapi import Response, Request
 from fastapi import Depends, FastAPI, HTTPException, status
 from datetime import datetime, timedelta
-from typing import List, Union
+from typing import List, Optional, Union
 
 from fastapi import APIRouter, status
 from pydantic import BaseModel
 import time
 import uuid
 import re
+import json
 
 from apps.web.models.auths import (
     SigninForm,
@@ -19,6 +20,7 @@ from apps.web.models.auths import (
     Auths,
 )
 from apps.web.models.users import Users
+from apps.web.models.chats import Chats
 
 from utils.utils import (
     get_password_hash,
@@ -28,6 +30,7 @@ from utils.utils import (
 )
 from utils.misc import parse_duration, validate_email_format
 from constants import ERROR_MESSAGES
+from config import OLLAMA_PREWARM_ON_LOGIN
 
 router = APIRouter()
 
@@ -95,6 +98,22 @@ async def update_password(
 ############################
 
 
+def get_default_model(user_id: str, default_models: Optional[str]) -> Optional[str]:
+    # The model of the user's latest chat, otherwise the first default model
+    chat = Chats.get_latest_chat_by_user_id(user_id)
+    if chat:
+        try:
+            models = [m for m in json.loads(chat.chat).get("models", []) if m]
+            if models:
+                return models[0]
+        except Exception as e:
+            print(e)
+
+    if default_models:
+        return default_models.split(",")[0] or None
+    return None
+
+
 @router.post("/signin", response_model=SigninResponse)
 async def signin(request: Request, form_data: SigninForm):
     user = Auths.authenticate_user(form_data.email.lower(), form_data.password)
@@ -104,6 +123,13 @@ async def signin(request: Request, form_data: SigninForm):
             expires_delta=parse_duration(request.app.state.JWT_EXPIRES_IN),
         )
 
+        prewarm_model = request.app.state.PREWARM_MODEL
+        if OLLAMA_PREWARM_ON_LOGIN and prewarm_model:
+            model = get_default_model(user.id, request.app.state.DEFAULT_MODELS)
+            if model:
+                # Load the model while the UI is still starting up
+                prewarm_model(model)
+
         return {
             "token": token,
             "token_type": "Bearer",
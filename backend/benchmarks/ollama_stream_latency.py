@@ -0,0 +1,157 @@
+"""Per-token delivery latency through the Ollama proxy.
+
+Starts a fake Ollama that streams timestamped NDJSON token frames, optionally
+writing every frame in two pieces, and measures how long each complete frame
+takes to reach a client: directly from the fake upstream, through the proxy
+passing raw chunks, and through the proxy forwarding whole lines. Also counts
+the chunks a client receives that end in the middle of a frame.
+
+Needs the backend dependencies installed. Usage (from the backend directory):
+    python benchmarks/ollama_stream_latency.py --tokens 200 --interval 0.01 --split
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import aiohttp
+import uvicorn
+from aiohttp import web
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import apps.ollama.main as ollama
+from utils.utils import get_current_user
+
+
+UPSTREAM_PORT = 18501
+PROXY_PORT = 18502
+
+
+class BenchmarkUser:
+    id = "benchmark"
+    role = "admin"
+
+
+def make_upstream(tokens: int, interval: float, split: bool):
+    async def chat(request):
+        await request.read()
+        response = web.StreamResponse()
+        response.content_type = "application/x-ndjson"
+        await response.prepare(request)
+
+        for i in range(tokens + 1):
+            frame = (
+                json.dumps(
+                    {
+                        "model": "benchmark",
+                        "message": {"role": "assistant", "content": f" token{i}"},
+                        "done": i == tokens,
+                        "sent": time.time(),
+                    }
+                )
+                + "\n"
+            ).encode("utf-8")
+
+            if split:
+                await response.write(frame[: len(frame) // 2])
+                await asyncio.sleep(0.001)
+                await response.write(frame[len(frame) // 2 :])
+            else:
+                await response.write(frame)
+            await asyncio.sleep(interval)
+
+        return response
+
+    app = web.Application()
+    app.router.add_post("/api/chat", chat)
+    return app
+
+
+async def measure(url: str) -> dict:
+    delays = []
+    split_chunks = 0
+    pending = b""
+
+    async with aiohttp.ClientSession() as session:
+        async with session.post(url, json={"model": "benchmark", "messages": []}) as r:
+            async for chunk in r.content.iter_any():
+                received = time.time()
+                if not chunk.endswith(b"\n"):
+                    split_chunks += 1
+
+                lines = (pending + chunk).split(b"\n")
+                pending = lines.pop()
+                for line in lines:
+                    data = json.loads(line)
+                    if "sent" in data:
+                        delays.append((received - data["sent"]) * 1000)
+
+    delays.sort()
+    return {
+        "frames": len(delays),
+        "p50": statistics.median(delays),
+        "p95": delays[int(len(delays) * 0.95) - 1],
+        "max": delays[-1],
+        "split_chunks": split_chunks,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tokens", type=int, default=200)
+    parser.add_argument("--interval", type=float, default=0.01)
+    parser.add_argument(
+        "--split", action="store_true", help="write every frame in two pieces"
+    )
+    args = parser.parse_args()
+
+    runner = web.AppRunner(make_upstream(args.tokens, args.interval, args.split))
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", UPSTREAM_PORT).start()
+
+    upstream_url = f"http://127.0.0.1:{UPSTREAM_PORT}"
+    ollama.app.state.OLLAMA_BASE_URLS = [upstream_url]
+    ollama.BACKEND_POOL.set_urls([upstream_url])
+    ollama.app.dependency_overrides[get_current_user] = lambda: BenchmarkUser()
+
+    server = uvicorn.Server(
+        uvicorn.Config(
+            ollama.app, host="127.0.0.1", port=PROXY_PORT, log_level="warning"
+        )
+    )
+    serve_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+
+    line_aligned = ollama.LINE_ALIGNED_CONTENT_TYPES
+    runs = [
+        ("direct", f"{upstream_url}/api/chat", line_aligned),
+        ("proxy raw", f"http://127.0.0.1:{PROXY_PORT}/api/chat", []),
+        ("proxy lines", f"http://127.0.0.1:{PROXY_PORT}/api/chat", line_aligned),
+    ]
+
+    print(
+        f"{args.tokens} frames every {args.interval * 1000:.0f} ms, split={args.split}"
+    )
+    print(f"{'':<12} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8} {'split chunks':>13}")
+    for name, url, content_types in runs:
+        ollama.LINE_ALIGNED_CONTENT_TYPES = content_types
+        result = await measure(url)
+        print(
+            f"{name:<12} {result['p50']:>8.2f} {result['p95']:>8.2f} "
+            f"{result['max']:>8.2f} {result['split_chunks']:>13}"
+        )
+
+    server.should_exit = True
+    await serve_task
+    await ollama.close_session()
+    await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,88 @@
+"""Microbenchmark for the Ollama proxy request transforms.
+
+Compares the previous approach (each transform decodes, parses and
+re-serializes the body on its own) with the single-parse pipeline in
+apps/ollama/transforms.py, on a chat body with a long message history.
+
+Usage (from the backend directory):
+    python benchmarks/ollama_transforms.py --messages 100
+"""
+
+import argparse
+import json
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from apps.ollama.transforms import add_system_prompt, add_user_prefix, transform_body
+
+
+SYSTEM_PROMPT = (
+    "You are designed exclusively for creating personalized nutrition plans. " * 8
+)
+USER_PREFIX = "I'll tell you the following about myself. "
+
+
+def legacy_add_system_prompt(body, custom_content):
+    body = json.loads(body.decode("utf-8"))
+    if isinstance(body, dict) and "messages" in body:
+        body["messages"].insert(0, {"role": "system", "content": custom_content})
+    return json.dumps(body).encode("utf-8")
+
+
+def legacy_add_prefix_to_user_messages(body, prefix):
+    body = json.loads(body.decode("utf-8"))
+    if isinstance(body, dict) and "messages" in body:
+        for message in body["messages"]:
+            if message.get("role") == "user":
+                message["content"] = prefix + message["content"]
+    return json.dumps(body).encode("utf-8")
+
+
+def legacy(body):
+    body = legacy_add_system_prompt(body, SYSTEM_PROMPT)
+    return legacy_add_prefix_to_user_messages(body, USER_PREFIX)
+
+
+def pipeline(body):
+    return transform_body(
+        body, [add_system_prompt(SYSTEM_PROMPT), add_user_prefix(USER_PREFIX)]
+    )[1]
+
+
+def make_body(messages: int, length: int) -> bytes:
+    return json.dumps(
+        {
+            "model": "llama2:latest",
+            "messages": [
+                {
+                    "role": "user" if i % 2 == 0 else "assistant",
+                    "content": f"message {i} " + "lorem ipsum dolor sit amet " * length,
+                }
+                for i in range(messages)
+            ],
+            "options": {},
+        }
+    ).encode("utf-8")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=100)
+    parser.add_argument("--length", type=int, default=40, help="words per message / 5")
+    parser.add_argument("--number", type=int, default=200)
+    args = parser.parse_args()
+
+    body = make_body(args.messages, args.length)
+    assert json.loads(legacy(body)) == json.loads(pipeline(body))
+
+    print(f"{args.messages} messages, {len(body) / 1024:.0f} KB body")
+    for name, fn in [("legacy", legacy), ("pipeline", pipeline)]:
+        seconds = min(timeit.repeat(lambda: fn(body), number=args.number, repeat=5))
+        print(f"{name:<10} {seconds / args.number * 1e6:>10.0f} us/request")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""Compare the character and token text splitters used by the RAG app.
+
+Reports chunks/sec, how many chunks exceed the embedding model's window
+(and so get truncated) and a self-supervised retrieval score: random
+sentences from the corpus are used as queries and a hit is counted when
+the chunk containing that sentence is in the top k results.
+
+Usage (from the backend directory):
+    python benchmarks/rag_splitter.py docs/*.txt --chunk-size 256 --chunk-overlap 32
+"""
+
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_core.documents import Document
+from sentence_transformers import SentenceTransformer
+
+from apps.rag.splitter import TokenTextSplitter, get_embedding_tokenizer
+
+
+def load_pages(paths):
+    for path in paths:
+        text = Path(path).read_text(encoding="utf-8", errors="ignore")
+        # Treat every 50 lines as a page, as PDF loaders yield one document per page
+        lines = text.splitlines(keepends=True)
+        for i in range(0, len(lines), 50):
+            yield Document(
+                page_content="".join(lines[i : i + 50]),
+                metadata={"source": str(path), "page": i // 50},
+            )
+
+
+def time_split(splitter, pages):
+    start = time.perf_counter()
+    chunks = list(splitter.split_documents(pages))
+    elapsed = time.perf_counter() - start
+    return chunks, elapsed
+
+
+def retrieval_hit_rate(model, chunks, queries, k):
+    texts = [chunk.page_content for chunk in chunks]
+    chunk_embeddings = model.encode(texts, normalize_embeddings=True, batch_size=64)
+    query_embeddings = model.encode(queries, normalize_embeddings=True, batch_size=64)
+
+    hits = 0
+    for query, embedding in zip(queries, query_embeddings):
+        scores = chunk_embeddings @ embedding
+        top = scores.argsort()[::-1][:k]
+        if any(query in texts[i] for i in top):
+            hits += 1
+    return hits / len(queries) if queries else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--chunk-size", type=int, default=256)
+    parser.add_argument("--chunk-overlap", type=int, default=32)
+    parser.add_argument("--char-chunk-size", type=int, default=1500)
+    parser.add_argument("--char-chunk-overlap", type=int, default=100)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=4)
+    args = parser.parse_args()
+
+    pages = list(load_pages(args.files))
+    model = SentenceTransformer(args.model)
+    tokenizer = get_embedding_tokenizer(args.model)
+    max_length = model.max_seq_length
+
+    splitters = {
+        "character": RecursiveCharacterTextSplitter(
+            chunk_size=args.char_chunk_size, chunk_overlap=args.char_chunk_overlap
+        ),
+        "token": TokenTextSplitter(
+            tokenizer=tokenizer,
+            chunk_size=args.chunk_size,
+            chunk_overlap=args.chunk_overlap,
+            max_length=max_length,
+        ),
+    }
+
+    sentences = [
+        sentence.strip()
+        for page in pages
+        for sentence in page.page_content.split(". ")
+        if len(sentence.split()) >= 8
+    ]
+    random.seed(0)
+    queries = random.sample(sentences, min(args.queries, len(sentences)))
+
+    print(f"{len(pages)} pages, {len(queries)} queries, model window {max_length}")
+    print(
+        f"{'splitter':<10} {'chunks':>7} {'chunks/s':>10} {'truncated':>10} "
+        f"{'avg tok':>8} {'hit@' + str(args.k):>7}"
+    )
+
+    for name, splitter in splitters.items():
+        chunks, elapsed = time_split(splitter, pages)
+        # Counted with [CLS]/[SEP], as the embedder sees them
+        lengths = [
+            len(ids)
+            for ids in tokenizer([chunk.page_content for chunk in chunks])["input_ids"]
+        ]
+        truncated = sum(1 for length in lengths if length > max_length)
+        hit_rate = retrieval_hit_rate(model, chunks, queries, args.k)
+
+        print(
+            f"{name:<10} {len(chunks):>7} {len(chunks) / elapsed:>10.0f} "
+            f"{truncated:>10} {sum(lengths) / max(len(lengths), 1):>8.0f} "
+            f"{hit_rate:>7.2%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
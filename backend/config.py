@@ -221,6 +221,116 @@ if OLLAMA_BASE_URL == "":
         else OLLAMA_API_BASE_URL
     )
 
+# several Ollama servers can be load balanced, separated by ";" - defaults to OLLAMA_BASE_URL
+OLLAMA_BASE_URLS = [
+    url.strip()
+    for url in os.environ.get("OLLAMA_BASE_URLS", OLLAMA_BASE_URL).split(";")
+    if url.strip()
+]
+OLLAMA_HEALTH_CHECK_INTERVAL = float(
+    os.environ.get("OLLAMA_HEALTH_CHECK_INTERVAL", "10")
+)
+
+# shared connection pool for the Ollama proxy
+OLLAMA_POOL_MAXSIZE = int(os.environ.get("OLLAMA_POOL_MAXSIZE", "100"))
+OLLAMA_POOL_KEEPALIVE = float(os.environ.get("OLLAMA_POOL_KEEPALIVE", "60"))
+OLLAMA_CONNECT_TIMEOUT = float(os.environ.get("OLLAMA_CONNECT_TIMEOUT", "10"))
+# max seconds between two chunks of a response, model loads count against it
+OLLAMA_READ_TIMEOUT = float(os.environ.get("OLLAMA_READ_TIMEOUT", "600"))
+# in-flight requests older than this (seconds) are closed and dropped from the registry
+OLLAMA_REQUEST_TTL = float(os.environ.get("OLLAMA_REQUEST_TTL", "3600"))
+
+# tags/show/version/ps responses are cached for this long (seconds, 0 disables), and
+# served stale while being refreshed for OLLAMA_METADATA_CACHE_STALE_TTL more seconds
+OLLAMA_METADATA_CACHE_TTL = float(os.environ.get("OLLAMA_METADATA_CACHE_TTL", "10"))
+OLLAMA_METADATA_CACHE_STALE_TTL = float(
+    os.environ.get("OLLAMA_METADATA_CACHE_STALE_TTL", "300")
+)
+
+# opt-in cache of complete chat/generate responses for requests with temperature 0
+# or a fixed seed, replayed with the original stream framing (sizes in MB)
+OLLAMA_RESPONSE_CACHE = (
+    os.environ.get("OLLAMA_RESPONSE_CACHE", "False").lower() == "true"
+)
+OLLAMA_RESPONSE_CACHE_MAX_SIZE = float(
+    os.environ.get("OLLAMA_RESPONSE_CACHE_MAX_SIZE", "64")
+)
+OLLAMA_RESPONSE_CACHE_MAX_ENTRY_SIZE = float(
+    os.environ.get("OLLAMA_RESPONSE_CACHE_MAX_ENTRY_SIZE", "4")
+)
+
+# concurrent /api/embeddings requests for the same model arriving within this window
+# (seconds, 0 disables) are batched. "pipeline" keeps one /api/embeddings call per prompt;
+# "embed" sends them as one /api/embed call, which returns unit-length vectors instead of
+# the raw ones /api/embeddings (and Chroma collections built from it) use, so only pick it
+# when every client normalizes or compares by cosine
+OLLAMA_EMBEDDING_BATCH_WINDOW = float(
+    os.environ.get("OLLAMA_EMBEDDING_BATCH_WINDOW", "0.01")
+)
+OLLAMA_EMBEDDING_BATCH_SIZE = int(os.environ.get("OLLAMA_EMBEDDING_BATCH_SIZE", "32"))
+OLLAMA_EMBEDDING_BATCH_MODE = os.environ.get("OLLAMA_EMBEDDING_BATCH_MODE", "pipeline")
+
+# /api/generate contexts kept server-side for clients that send a "context_id" handle
+# instead of the token array, least recently used first out (size in MB, ttl in seconds)
+OLLAMA_CONTEXT_STORE_MAX_SIZE = float(
+    os.environ.get("OLLAMA_CONTEXT_STORE_MAX_SIZE", "64")
+)
+OLLAMA_CONTEXT_STORE_TTL = float(os.environ.get("OLLAMA_CONTEXT_STORE_TTL", "3600"))
+
+# replies to /chats/{id}/messages are written to the stored chat at most this often
+# (seconds) while they stream, and once more when they finish
+OLLAMA_CHAT_SAVE_INTERVAL = float(os.environ.get("OLLAMA_CHAT_SAVE_INTERVAL", "2"))
+
+# chat history is trimmed to the model's context window before it is forwarded, keeping
+# system messages and the most recent turns. The window is the request's num_ctx, else
+# the model's, minus OLLAMA_HISTORY_RESPONSE_RESERVE tokens for the reply (or num_predict).
+# OLLAMA_HISTORY_TOKEN_BUDGETS sets the budget per model instead, e.g. {"llama2": 4096}
+OLLAMA_HISTORY_TRUNCATION = (
+    os.environ.get("OLLAMA_HISTORY_TRUNCATION", "True").lower() == "true"
+)
+OLLAMA_HISTORY_TOKEN_BUDGETS = json.loads(
+    os.environ.get("OLLAMA_HISTORY_TOKEN_BUDGETS", "{}")
+)
+OLLAMA_HISTORY_RESPONSE_RESERVE = int(
+    os.environ.get("OLLAMA_HISTORY_RESPONSE_RESERVE", "512")
+)
+
+# keep the OLLAMA_RESIDENT_MODELS most requested models loaded (0 disables), as long
+# as their size on disk fits in OLLAMA_RESIDENCY_MEMORY_BUDGET (GB, 0 for no limit)
+OLLAMA_RESIDENT_MODELS = int(os.environ.get("OLLAMA_RESIDENT_MODELS", "0"))
+OLLAMA_RESIDENCY_MEMORY_BUDGET = float(
+    os.environ.get("OLLAMA_RESIDENCY_MEMORY_BUDGET", "0")
+)
+OLLAMA_RESIDENCY_KEEP_ALIVE = os.environ.get("OLLAMA_RESIDENCY_KEEP_ALIVE", "30m")
+OLLAMA_RESIDENCY_INTERVAL = float(os.environ.get("OLLAMA_RESIDENCY_INTERVAL", "60"))
+# load a user's most recently used model (or the default model) when they sign in
+OLLAMA_PREWARM_ON_LOGIN = (
+    os.environ.get("OLLAMA_PREWARM_ON_LOGIN", "True").lower() == "true"
+)
+
+# admission control for chat/generate: concurrent requests per backend, then a fair queue
+OLLAMA_MAX_CONCURRENT_REQUESTS = int(
+    os.environ.get("OLLAMA_MAX_CONCURRENT_REQUESTS", "4")
+)
+OLLAMA_MAX_QUEUE_SIZE = int(os.environ.get("OLLAMA_MAX_QUEUE_SIZE", "64"))
+OLLAMA_MAX_QUEUE_PER_USER = int(os.environ.get("OLLAMA_MAX_QUEUE_PER_USER", "8"))
+
+# injected into every chat request by the proxy, editable by admins at runtime
+OLLAMA_SYSTEM_PROMPT = """
+You are designed exclusively for creating personalized nutrition plans for patients based on their specific health conditions and dietary needs. Upon receiving a patient's data, including their health conditions, allergies, and dietary preferences, you will generate a balanced diet plan tailored to their requirements. You should STRICTLY adhere to the following strict guidelines:
+I REPEAT - STRICTLY ADHERE TO THE FOLLOWING GUIDELINES:
+- IMPORTANT: You should only respond to requests related to creating personalized nutrition plans. 
+- IMPORTANT: If asked about any other topic, you must explicitly REFUSE to ANSWER, stating that responding to such queries is against your policy
+- If the necessary patient data is not provided in the request, you WILL ASK for this data before proceeding.
+- You will NEVER make assumptions or deductions without receiving specific patient data. This is to ensure the safety and well-being of the patients involved.
+
+By adhering to these guidelines, you should ensure that you provide accurate, safe, and legally compliant dietary recommendations to patients.
+"""
+
+OLLAMA_USER_PREFIX = """
+I'll tell you the following about myself, please say "This is off-topic" if this is out of your domain, else respond to my queries.
+"""
+
 
 ####################################
 # OPENAI_API
@@ -232,6 +342,29 @@ OPENAI_API_BASE_URL = os.environ.get("OPENAI_API_BASE_URL", "")
 if OPENAI_API_BASE_URL == "":
     OPENAI_API_BASE_URL = "https://api.openai.com/v1"
 
+# shared connection pool for the OpenAI proxy
+OPENAI_POOL_MAXSIZE = int(os.environ.get("OPENAI_POOL_MAXSIZE", "100"))
+OPENAI_POOL_KEEPALIVE = float(os.environ.get("OPENAI_POOL_KEEPALIVE", "60"))
+OPENAI_CONNECT_TIMEOUT = float(os.environ.get("OPENAI_CONNECT_TIMEOUT", "10"))
+# max seconds between two chunks of a response
+OPENAI_READ_TIMEOUT = float(os.environ.get("OPENAI_READ_TIMEOUT", "300"))
+# requests are held back to stay within the upstream's x-ratelimit-* limits, for at most
+# OPENAI_MAX_QUEUE_WAIT seconds. 429/503 answers are retried up to OPENAI_MAX_RETRIES
+# times, unless the upstream asks to wait longer than OPENAI_MAX_RETRY_DELAY seconds
+OPENAI_MAX_QUEUE_WAIT = float(os.environ.get("OPENAI_MAX_QUEUE_WAIT", "30"))
+OPENAI_MAX_RETRIES = int(os.environ.get("OPENAI_MAX_RETRIES", "3"))
+OPENAI_MAX_RETRY_DELAY = float(os.environ.get("OPENAI_MAX_RETRY_DELAY", "20"))
+
+
+####################################
+# MODEL CATALOGUE
+####################################
+
+# /api/models lists the models of every provider, each list cached for this long
+# (seconds). Providers slower than MODEL_CATALOGUE_TIMEOUT are served from their last list
+MODEL_CATALOGUE_TTL = float(os.environ.get("MODEL_CATALOGUE_TTL", "30"))
+MODEL_CATALOGUE_TIMEOUT = float(os.environ.get("MODEL_CATALOGUE_TIMEOUT", "3"))
+
 
 ####################################
 # WEBUI
@@ -297,6 +430,21 @@ CHROMA_CLIENT = chromadb.PersistentClient(
 )
 CHUNK_SIZE = 1500
 CHUNK_OVERLAP = 100
+# "character" (default) or "token" - token mode measures CHUNK_SIZE and CHUNK_OVERLAP in embedding model tokens
+RAG_TEXT_SPLITTER = os.environ.get("RAG_TEXT_SPLITTER", "character")
+
+# extracted text from document loaders, keyed by file sha256, so collections can be re-chunked without re-parsing
+RAG_PARSED_CACHE_DIR = f"{CACHE_DIR}/rag/parsed"
+Path(RAG_PARSED_CACHE_DIR).mkdir(parents=True, exist_ok=True)
+
+# near-duplicate detection at ingestion - "off", "flag" (embed and record) or "skip" (reuse the existing collection)
+RAG_DEDUP_MODE = os.environ.get("RAG_DEDUP_MODE", "flag")
+RAG_DEDUP_THRESHOLD = float(os.environ.get("RAG_DEDUP_THRESHOLD", "0.9"))
+RAG_MINHASH_INDEX_PATH = f"{CACHE_DIR}/rag/minhash.json"
+
+# garbage collection of unreferenced collections and uploads - interval in hours, 0 disables the schedule
+RAG_GC_INTERVAL = float(os.environ.get("RAG_GC_INTERVAL", "0"))
+RAG_GC_MIN_AGE = int(os.environ.get("RAG_GC_MIN_AGE", "3600"))
 
 
 RAG_TEMPLATE = """Use the following context as your learned knowledge, inside <context></context> XML tags.
@@ -48,3 +48,4 @@ class ERROR_MESSAGES(str, Enum):
         lambda err="": f"Invalid format. Please use the correct format{err if err else ''}"
     )
     RATE_LIMIT_EXCEEDED = "API rate limit exceeded"
+    QUEUE_FULL = "The server is busy right now. Please try again in a moment."
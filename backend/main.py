@@ -17,19 +17,38 @@ from starlette.exceptions import HTTPException as StarletteHTTPException
 
 from litellm.proxy.proxy_server import ProxyConfig, initialize
 from litellm.proxy.proxy_server import app as litellm_app
+from litellm.proxy import proxy_server as litellm_proxy_server
 
-from apps.ollama.main import app as ollama_app
-from apps.openai.main import app as openai_app
+from apps.ollama.main import (
+    app as ollama_app,
+    close_session as close_ollama_session,
+    schedule_prewarm,
+    get_models as get_ollama_models,
+)
+from apps.openai.main import (
+    app as openai_app,
+    close_session as close_openai_session,
+    get_models as get_openai_models,
+)
 from apps.audio.main import app as audio_app
 from apps.images.main import app as images_app
-from apps.rag.main import app as rag_app
+from apps.rag.main import app as rag_app, start_gc_scheduler
 from apps.web.main import app as webui_app
 
 
-from config import WEBUI_NAME, ENV, VERSION, CHANGELOG, FRONTEND_BUILD_DIR
+from config import (
+    WEBUI_NAME,
+    ENV,
+    VERSION,
+    CHANGELOG,
+    FRONTEND_BUILD_DIR,
+    MODEL_CATALOGUE_TTL,
+    MODEL_CATALOGUE_TIMEOUT,
+)
 from constants import ERROR_MESSAGES
 
-from utils.utils import get_http_authorization_cred, get_current_user
+from utils.utils import get_http_authorization_cred, get_current_user, get_verified_user
+from utils.catalogue import ModelCatalogue
 
 
 class SPAStaticFiles(StaticFiles):
@@ -56,6 +75,7 @@ async def config():
 
 async def startup():
     await config()
+    rag_app.state.gc_scheduler = start_gc_scheduler()
 
 
 app = FastAPI(docs_url="/docs" if ENV == "dev" else None, redoc_url=None)
@@ -76,6 +96,12 @@ async def on_startup():
     await startup()
 
 
+@app.on_event("shutdown")
+async def on_shutdown():
+    await close_ollama_session()
+    await close_openai_session()
+
+
 @app.middleware("http")
 async def check_url(request: Request, call_next):
     start_time = int(time.time())
@@ -101,6 +127,8 @@ async def auth_middleware(request: Request, call_next):
     return response
 
 
+webui_app.state.PREWARM_MODEL = schedule_prewarm
+
 app.mount("/api/v1", webui_app)
 app.mount("/litellm/api", litellm_app)
 
@@ -125,6 +153,60 @@ async def get_app_config():
     }
 
 
+# Same shapes the frontend used to build from each provider's own endpoint
+async def get_ollama_catalogue():
+    models = [
+        {
+            "id": model.get("model") or model["name"],
+            "name": model.get("name") or model.get("model"),
+            **model,
+        }
+        for model in await get_ollama_models()
+    ]
+    return sorted(models, key=lambda model: model["name"])
+
+
+async def get_openai_catalogue():
+    models = await get_openai_models()
+    if models == None:
+        return None
+
+    models = [
+        {"id": model["id"], "name": model.get("name") or model["id"], "external": True}
+        for model in models
+    ]
+    return sorted(models, key=lambda model: model["name"])
+
+
+async def get_litellm_catalogue():
+    # Read from the loaded LiteLLM config, no HTTP round trip through its proxy
+    names = []
+    for model in litellm_proxy_server.llm_model_list or []:
+        if model.get("model_name") and model["model_name"] not in names:
+            names.append(model["model_name"])
+
+    return [
+        {"id": name, "name": name, "external": True, "source": "litellm"}
+        for name in sorted(names)
+    ]
+
+
+MODEL_CATALOGUE = ModelCatalogue(
+    {
+        "ollama": get_ollama_catalogue,
+        "openai": get_openai_catalogue,
+        "litellm": get_litellm_catalogue,
+    },
+    ttl=MODEL_CATALOGUE_TTL,
+    timeout=MODEL_CATALOGUE_TIMEOUT,
+)
+
+
+@app.get("/api/models")
+async def get_app_models(refresh: bool = False, user=Depends(get_verified_user)):
+    return await MODEL_CATALOGUE.get(refresh)
+
+
 @app.get("/api/changelog")
 async def get_app_changelog():
     return CHANGELOG
@@ -0,0 +1,72 @@
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+import asyncio
+import time
+
+
+class ModelCatalogue:
+    """Model lists from several providers, fetched concurrently.
+
+    Each provider's list is cached for ``ttl`` seconds. A provider that does
+    not answer within ``timeout`` seconds is served from its last list (or
+    left out), while its fetch carries on in the background for the next call.
+    """
+
+    def __init__(
+        self,
+        providers: Dict[str, Callable[[], Awaitable[Optional[list]]]],
+        ttl: float = 30,
+        timeout: float = 3,
+    ):
+        self.providers = providers
+        self.ttl = ttl
+        self.timeout = timeout
+        self.entries: Dict[str, Tuple[Optional[list], float]] = {}
+        self.tasks: Dict[str, asyncio.Task] = {}
+
+    def fetch(self, name: str) -> asyncio.Task:
+        # At most one fetch per provider at a time
+        task = self.tasks.get(name)
+        if task is not None and not task.done():
+            return task
+
+        async def run():
+            models = await self.providers[name]()
+            self.entries[name] = (models, time.time())
+            return models
+
+        task = asyncio.ensure_future(run())
+        # Nobody may be waiting on it anymore when it fails
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        self.tasks[name] = task
+        return task
+
+    async def get_provider(self, name: str, refresh: bool = False):
+        entry = self.entries.get(name)
+        if entry != None and not refresh and time.time() - entry[1] < self.ttl:
+            return entry[0], None
+
+        try:
+            models = await asyncio.wait_for(
+                asyncio.shield(self.fetch(name)), self.timeout
+            )
+            return models, None
+        except asyncio.TimeoutError:
+            error = "Timed out"
+        except Exception as e:
+            print(e)
+            error = getattr(e, "detail", None) or str(e) or e.__class__.__name__
+
+        return (entry[0] if entry != None else None), error
+
+    async def get(self, refresh: bool = False) -> dict:
+        names = list(self.providers.keys())
+        results = await asyncio.gather(
+            *[self.get_provider(name, refresh) for name in names]
+        )
+
+        return {
+            "models": {name: models for name, (models, _) in zip(names, results)},
+            "errors": {
+                name: error for name, (_, error) in zip(names, results) if error
+            },
+        }
@@ -2,7 +2,7 @@ from pathlib import Path
 import hashlib
 import re
 from datetime import timedelta
-from typing import Optional
+from typing import AsyncIterator, Optional
 
 
 def get_gravatar_url(email):
@@ -109,3 +109,29 @@ def parse_duration(duration: str) -> Optional[timedelta]:
             total_duration += timedelta(weeks=number)
 
     return total_duration
+
+
+async def align_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Re-chunk a byte stream so every chunk ends on a newline.
+
+    Complete lines (NDJSON frames, SSE lines) are passed on as soon as they
+    arrive. A chunk that already ends on a newline is yielded as-is, only a
+    trailing partial line is held back until the rest of it comes in.
+    """
+    pending = b""
+    async for chunk in chunks:
+        if pending:
+            chunk = pending + chunk
+            pending = b""
+
+        end = chunk.rfind(b"\n") + 1
+        if end == len(chunk):
+            yield chunk
+        elif end == 0:
+            pending = chunk
+        else:
+            yield chunk[:end]
+            pending = chunk[end:]
+
+    if pending:
+        yield pending
@@ -26,6 +26,34 @@ export const getBackendConfig = async () => {
 	return res;
 };
 
+export const getModelCatalogue = async (token: string = '', refresh: boolean = false) => {
+	let error = null;
+
+	const res = await fetch(`${WEBUI_BASE_URL}/api/models${refresh ? '?refresh=true' : ''}`, {
+		method: 'GET',
+		headers: {
+			Accept: 'application/json',
+			'Content-Type': 'application/json',
+			...(token && { authorization: `Bearer ${token}` })
+		}
+	})
+		.then(async (res) => {
+			if (!res.ok) throw await res.json();
+			return res.json();
+		})
+		.catch((err) => {
+			console.log(err);
+			error = err;
+			return null;
+		});
+
+	if (error) {
+		throw error;
+	}
+
+	return res;
+};
+
 export const getChangelog = async () => {
 	let error = null;
 
@@ -152,6 +152,7 @@ export const generateTitle = async (
 		method: 'POST',
 		headers: {
 			'Content-Type': 'text/event-stream',
+			'X-Request-Priority': 'background',
 			Authorization: `Bearer ${token}`
 		},
 		body: JSON.stringify({
@@ -267,6 +268,30 @@ export const generateChatCompletion = async (token: string = '', body: object) =
 	return [res, controller];
 };
 
+export const generateChatMessage = async (token: string = '', chatId: string, body: object) => {
+	let controller = new AbortController();
+	let error = null;
+
+	const res = await fetch(`${OLLAMA_API_BASE_URL}/chats/${chatId}/messages`, {
+		signal: controller.signal,
+		method: 'POST',
+		headers: {
+			'Content-Type': 'text/event-stream',
+			Authorization: `Bearer ${token}`
+		},
+		body: JSON.stringify(body)
+	}).catch((err) => {
+		error = err;
+		return null;
+	});
+
+	if (error) {
+		throw error;
+	}
+
+	return [res, controller];
+};
+
 export const cancelChatCompletion = async (token: string = '', requestId: string) => {
 	let error = null;
 